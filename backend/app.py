@@ -1,29 +1,85 @@
 import os
+import threading
 from datetime import timedelta
 
-from flask import Flask
+from flask import Flask, jsonify
 from flask_jwt_extended import JWTManager
 
 from routes.auth import auth
 from routes.hospital import hospital
 from routes.patient import patient
 from helpers.utils.config import initialize_db, Config
+from helpers.utils.blob_cache import blob_cache
+from helpers.utils.cpu_pool import cpu_pool
+from helpers.utils.identity_cache import identity_cache
+from models.indexes import ensure_indexes
+from services.face_index import face_index
+from services.face_embedding import face_embedding
+from services.sui_blockchain import key_cache_metrics, sui_clients
 
-app = Flask(__name__)
-# sui_client = SuiClient(Config.SUI_RPC_URL)
+_started = False
+_start_lock = threading.Lock()
 
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
-app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
-jwt = JWTManager(app)
 
-app.config.from_object(Config)
-initialize_db()
+def start_services():
+    """Connects to Mongo, builds indexes and warms the face index and model, once per process.
 
-app.register_blueprint(auth, url_prefix="/api/auth")
-app.register_blueprint(hospital, url_prefix="/api/hospital")
-app.register_blueprint(patient, url_prefix="/api/patient")
+    Never runs at import time: CPU pool workers are spawned and re-import the
+    main module, and must not repeat any of this.
+    """
+    global _started
+    if _started:
+        return
+    with _start_lock:
+        if _started:
+            return
+        initialize_db()
+        if os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true":
+            ensure_indexes()
+        face_index.load_or_build()
+        face_embedding.start()
+        _started = True
+
+
+def create_app():
+    app = Flask(__name__)
+    # sui_client = SuiClient(Config.SUI_RPC_URL)
+
+    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
+    JWTManager(app)
+
+    app.config.from_object(Config)
+    # Servers without a startup hook (flask run, gunicorn) start on the first request
+    app.before_request(start_services)
+
+    app.register_blueprint(auth, url_prefix="/api/auth")
+    app.register_blueprint(hospital, url_prefix="/api/hospital")
+    app.register_blueprint(patient, url_prefix="/api/patient")
+
+    @app.route("/api/metrics", methods=["GET"])
+    def metrics():
+        return jsonify({
+            "face_embedding": face_embedding.metrics(),
+            "key_cache": key_cache_metrics(),
+            "blob_cache": blob_cache.metrics(),
+            "identity_cache": identity_cache.metrics(),
+            "cpu_pool": cpu_pool.metrics(),
+        }), 200
+
+    @app.route("/api/health", methods=["GET"])
+    def health():
+        sui = sui_clients.health_check()
+        status = 200 if sui["healthy"] == sui["idle_checked"] else 503
+        return jsonify({"sui": sui}), status
+
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    start_services()
+    app.run(debug=True)
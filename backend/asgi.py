@@ -0,0 +1,50 @@
+"""ASGI entrypoint.
+
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 5000 --workers 4
+
+Runs the same Flask app behind uvicorn. Each uvicorn worker hands requests
+to a pool of ASGI_THREADS threads, so up to that many are served at once;
+asgiref's WsgiToAsgi would run them all on a single thread. The I/O-heavy
+routes (store-ehr, access-ehr, confirm-ehr-update, request-access) are async
+views that also push their blocking Mongo, Redis and crypto steps onto
+worker threads, overlapping independent ones. ``python asgi.py`` starts
+uvicorn with UVICORN_WORKERS. Each worker runs app.start_services() from the
+ASGI lifespan startup event.
+"""
+import asyncio
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import app, start_services
+from helpers.utils.cpu_pool import cpu_pool
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 16))
+
+wsgi_app = WSGIMiddleware(app, workers=ASGI_THREADS)
+
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] != "lifespan":
+        await wsgi_app(scope, receive, send)
+        return
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.to_thread(start_services)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            cpu_pool.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "asgi:asgi_app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", 5000)),
+        workers=int(os.getenv("UVICORN_WORKERS", 4)),
+    )
@@ -0,0 +1,78 @@
+"""Measures how EHR crypto throughput scales with CPU pool workers.
+
+    python -m benchmarks.cpu_pool [--task decrypt] [--tasks 400] [--records 50]
+
+Each run pushes the same tasks through helpers.utils.cpu_pool from twice as
+many request threads as workers, mimicking concurrent hospital reads.
+``0`` workers is the old behaviour: everything on the request threads.
+``--task derive`` needs bip_utils.
+"""
+import argparse
+import os
+import random
+import threading
+import time
+
+from benchmarks.ehr_codec import make_ehr
+from helpers.utils import crypto_tasks
+from helpers.utils.cpu_pool import CPUPool
+
+MNEMONIC = "abandon abandon abandon abandon abandon abandon abandon abandon abandon abandon abandon about"
+
+
+def make_task(name, records):
+    ehr = make_ehr(records, random.Random(7))
+    if name == "encrypt":
+        return crypto_tasks.encode_and_encrypt_sections, (ehr, b"")
+    if name == "decrypt":
+        sections, key = crypto_tasks.encode_and_encrypt_sections(ehr, b"")
+        return crypto_tasks.decrypt_and_decode, ([(data, key) for data in sections.values()], b"")
+    return crypto_tasks.derive_private_key, (MNEMONIC,)
+
+
+def bench(workers, fn, args, tasks):
+    pool = CPUPool(workers=workers, max_pending=tasks)
+    pool.run(fn, *args)  # start the worker processes outside the timed section
+    threads = max(2 * workers, 1)
+    remaining = iter(range(tasks))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            pool.run(fn, *args)
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(threads)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stats = pool.metrics()["tasks"][fn.__name__]
+    pool.shutdown()
+    return tasks / elapsed, stats["avg_run_ms"], stats["avg_wait_ms"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--task", choices=["encrypt", "decrypt", "derive"], default="decrypt")
+    parser.add_argument("--tasks", type=int, default=400)
+    parser.add_argument("--records", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="*")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({0, 1, 2, 4, 8, cores} & set(range(cores + 1)))
+    fn, task_args = make_task(args.task, args.records)
+    print(f"{args.task}: {args.tasks} tasks, {cores} cores")
+    print(f"{'workers':>8} {'tasks/s':>10} {'run ms':>9} {'wait ms':>9}")
+    for workers in worker_counts:
+        rate, run_ms, wait_ms = bench(workers, fn, task_args, args.tasks)
+        print(f"{workers:>8} {rate:>10.1f} {run_ms:>9.2f} {wait_ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
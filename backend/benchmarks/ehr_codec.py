@@ -0,0 +1,90 @@
+"""Compares EHR payload size and encode/decode/encrypt time per codec.
+
+    python -m benchmarks.ehr_codec [--patients 200] [--records 50]
+
+The baseline is the original path: ``json.dumps(ehr, indent=2)`` + Fernet.
+Records are built from the record types in models/reports.py.
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+import msgspec
+from cryptography.fernet import Fernet
+
+from helpers.utils import ehr_codec
+from models.reports import (
+    AllergyData, CoreVitalSigns, LaboratoryTestResults, MedicationHistory, TreatmentProgressNotes,
+)
+
+
+def make_ehr(records, rng):
+    day = date(2024, 1, 1)
+
+    def when(i):
+        return (day + timedelta(days=i)).isoformat()
+
+    return {
+        "Demographics": {"name": "John Doe", "email": "john@example.com", "phone": "1234567890",
+                         "DOB": "1990-11-18", "gender": "Male", "address": "123 Main St"},
+        "CoreVitalSigns": [msgspec.to_builtins(CoreVitalSigns(
+            blood_pressure=f"{rng.randint(100, 140)}/{rng.randint(60, 90)}",
+            heart_rate=rng.randint(55, 110),
+            temperature=round(rng.uniform(36.0, 39.5), 1),
+            recorded_at=when(i),
+            created_by="Hospital A",
+        )) for i in range(records)],
+        "LaboratoryTestResults": [msgspec.to_builtins(LaboratoryTestResults(
+            results=[{"test": test, "value": f"{rng.uniform(1, 200):.1f}", "unit": "mg/dL", "date": when(i)}
+                     for test in ("Glucose", "Cholesterol", "Creatinine")],
+            created_by="Lab B",
+        )) for i in range(records)],
+        "MedicationHistory": [msgspec.to_builtins(MedicationHistory(
+            date=when(i), medication=rng.choice(["Aspirin", "Paracetamol", "Metformin"]),
+            dose="500mg", hospital="Hospital A",
+        )) for i in range(records)],
+        "AllergyData": [msgspec.to_builtins(AllergyData(allergens=["Penicillin"], reactions=["Rash"], severity="Moderate"))],
+        "TreatmentProgressNotes": [msgspec.to_builtins(TreatmentProgressNotes(
+            doctors_notes="Patient responding well to treatment. " * 4,
+            treatment_plans=["Continue medication", "Physiotherapy"],
+            follow_up_dates=[when(i + 14)],
+        )) for i in range(records // 5)],
+    }
+
+
+def bench(name, ehrs, encode, decode):
+    fernet = Fernet(Fernet.generate_key())
+    started = time.perf_counter()
+    payloads = [encode(ehr) for ehr in ehrs]
+    encoded = time.perf_counter()
+    tokens = [fernet.encrypt(payload) for payload in payloads]
+    encrypted = time.perf_counter()
+    for token in tokens:
+        decode(fernet.decrypt(token))
+    decoded = time.perf_counter()
+    count = len(ehrs)
+    print(f"{name:<14} {sum(map(len, payloads)) / count:>10.0f} {sum(map(len, tokens)) / count:>10.0f} "
+          f"{(encoded - started) / count * 1e3:>9.3f} {(encrypted - encoded) / count * 1e3:>9.3f} "
+          f"{(decoded - encrypted) / count * 1e3:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--records", type=int, default=50, help="records per table")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    ehrs = [make_ehr(args.records, rng) for _ in range(args.patients)]
+
+    print(f"{'codec':<14} {'bytes':>10} {'stored':>10} {'encode ms':>9} {'encrypt ms':>9} {'decrypt+dec ms':>12}")
+    bench("json indent=2", ehrs, lambda ehr: json.dumps(ehr, indent=2).encode(), json.loads)
+    for codec in ehr_codec.FORMATS:
+        if codec.startswith("cbor") and ehr_codec.cbor2 is None:
+            continue
+        bench(codec, ehrs, lambda ehr, codec=codec: ehr_codec.encode(ehr, codec), ehr_codec.decode)
+
+
+if __name__ == "__main__":
+    main()
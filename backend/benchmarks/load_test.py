@@ -0,0 +1,92 @@
+"""Compares requests/s and latency percentiles of the WSGI and ASGI servers.
+
+    flask run --port 5000 &                          # WSGI
+    uvicorn asgi:asgi_app --port 5001 --workers 4 &  # ASGI
+    python -m benchmarks.load_test --path /api/hospital/request-access \\
+        --token <hospital_jwt> --json '{"patient_email": "john@example.com"}' \\
+        --target wsgi=http://localhost:5000 --target asgi=http://localhost:5001
+
+Every target gets the same request mix from ``--concurrency`` client threads
+for ``--duration`` seconds. Non-2xx responses are counted as errors and
+still contribute latency samples.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run_target(url, method, body, headers, concurrency, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request(url, data=body, method=method, headers=headers)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                failed += 1
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", action="append", required=True, metavar="NAME=BASE_URL")
+    parser.add_argument("--path", default="/api/health")
+    parser.add_argument("--method", default=None, help="defaults to POST with --json, GET otherwise")
+    parser.add_argument("--json", help="request body")
+    parser.add_argument("--token", help="JWT sent as a Bearer token")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    args = parser.parse_args()
+
+    body = json.dumps(json.loads(args.json)).encode() if args.json else None
+    method = args.method or ("POST" if body else "GET")
+    headers = {"Content-Type": "application/json"}
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+
+    print(f"{'target':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for target in args.target:
+        name, _, base_url = target.partition("=")
+        result = run_target(base_url.rstrip("/") + args.path, method, body, headers,
+                            args.concurrency, args.duration)
+        print(f"{name:<10} {result['requests']:>9} {result['errors']:>7} {result['rps']:>9.1f} "
+              f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
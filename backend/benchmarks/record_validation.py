@@ -0,0 +1,92 @@
+"""Measures validate+encode throughput for incoming CoreVitalSigns records.
+
+    python -m benchmarks.record_validation [--records 100000] [--repeat 3]
+
+``dict`` is the path updates took before validation existed: keep whatever
+is a dict and msgpack it. ``dict+checks`` adds the hand-written field and
+type checks that path would need to reject the same bad input. ``struct``
+is validate_updates() followed by the same msgpack step, which is what the
+update routes now run; ``struct direct`` skips the round trip to plain
+values and encodes the Structs with msgspec.
+"""
+import argparse
+import random
+import time
+
+import msgpack
+import msgspec
+
+from models.reports import METADATA_FIELDS, validate_records, validate_updates
+
+VITALS_FIELDS = {"blood_pressure": str, "heart_rate": int, "temperature": float, "recorded_at": str}
+
+
+def make_vitals(count, rng):
+    return [{
+        "blood_pressure": f"{rng.randint(100, 140)}/{rng.randint(60, 90)}",
+        "heart_rate": rng.randint(55, 110),
+        "temperature": round(rng.uniform(36.0, 39.5), 1),
+        "recorded_at": f"2024-01-01T{i % 24:02d}:{i % 60:02d}:00",
+        "created_by": "Hospital A",
+    } for i in range(count)]
+
+
+def dict_path(records):
+    return msgpack.packb({"CoreVitalSigns": [record for record in records if isinstance(record, dict)]})
+
+
+def dict_checked_path(records):
+    checked = []
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("record must be an object")
+        for name, kind in VITALS_FIELDS.items():
+            value = record.get(name)
+            if kind is float and isinstance(value, int) and not isinstance(value, bool):
+                value = float(value)
+            if not isinstance(value, kind) or isinstance(value, bool):
+                raise ValueError(f"{name} must be {kind.__name__}")
+        unknown = record.keys() - VITALS_FIELDS.keys() - set(METADATA_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown fields {sorted(unknown)}")
+        checked.append(record)
+    return msgpack.packb({"CoreVitalSigns": checked})
+
+
+def struct_path(records):
+    return msgpack.packb(validate_updates({"CoreVitalSigns": records}))
+
+
+encoder = msgspec.msgpack.Encoder()
+
+
+def struct_direct_path(records):
+    return encoder.encode({"CoreVitalSigns": validate_records("CoreVitalSigns", records)})
+
+
+def bench(name, fn, records, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = fn(records)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<14} {len(records) / best:>14,.0f} {best * 1e3:>10.1f} {len(payload):>12,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path; the best is reported")
+    args = parser.parse_args()
+    records = make_vitals(args.records, random.Random(0))
+
+    print(f"{'path':<14} {'records/s':>14} {'ms':>10} {'bytes':>12}")
+    bench("dict", dict_path, records, args.repeat)
+    bench("dict+checks", dict_checked_path, records, args.repeat)
+    bench("struct", struct_path, records, args.repeat)
+    bench("struct direct", struct_direct_path, records, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
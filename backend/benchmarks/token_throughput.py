@@ -0,0 +1,79 @@
+"""Measures access/update token operations per second against Redis.
+
+    python -m benchmarks.token_throughput [--tokens 2000] [--host localhost] [--port 6379]
+    python -m benchmarks.token_throughput --fake
+
+The baseline mirrors the original flow: a new ``redis.Redis`` client per
+request and separate SETEX/GET/DELETE calls for ``access_token:*`` and
+``update_token:*``. The pooled path uses HospitalAccessControl, where each
+step is one pipelined or scripted round trip (plus the lease completion). ``--fake`` runs against
+fakeredis (Lua needs the ``lupa`` package) and shows the call count rather
+than network cost.
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import timedelta
+
+import redis
+
+from helpers.managers.access_control import HospitalAccessControl
+
+UPDATES = {"CoreVitalSigns": [{"blood_pressure": "120/80", "heart_rate": 72, "recorded_at": "2024-01-01"}]}
+
+
+def baseline_cycle(make_client):
+    # propose_ehr_update
+    client = make_client()
+    token = str(uuid.uuid4())
+    client.setex(f"access_token:{token}", timedelta(minutes=10),
+                 json.dumps({"hospital_name": "Bench", "selected_tables": [], "med_vault_id": "MV-1"}))
+    client.setex(f"update_token:{token}", timedelta(minutes=10), json.dumps({"updates": UPDATES}))
+    # confirm_ehr_update
+    client = make_client()
+    assert client.get(f"access_token:{token}")
+    json.loads(client.get(f"update_token:{token}"))
+    client.delete(f"access_token:{token}")
+    client.delete(f"update_token:{token}")
+
+
+def pooled_cycle(make_client):
+    access_control = HospitalAccessControl(make_client())
+    token = access_control.generate_token("Bench", [], "MV-1", updates=UPDATES)
+    access_control = HospitalAccessControl(make_client())
+    with access_control.claim_token(token, with_updates=True) as lease:
+        assert lease.data and lease.updates
+
+
+def run(name, cycle, make_client, tokens):
+    started = time.perf_counter()
+    for _ in range(tokens):
+        cycle(make_client)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<10} {tokens / elapsed:>10.0f} tokens/s  {elapsed * 1000 / tokens:>7.3f} ms/token")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--fake", action="store_true", help="use fakeredis instead of a live server")
+    args = parser.parse_args()
+
+    if args.fake:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        baseline_client = pooled_client = lambda: fakeredis.FakeRedis(server=server, decode_responses=True)
+    else:
+        pool = redis.ConnectionPool(host=args.host, port=args.port, decode_responses=True)
+        baseline_client = lambda: redis.Redis(host=args.host, port=args.port, decode_responses=True)
+        pooled_client = lambda: redis.Redis(connection_pool=pool)
+
+    run("baseline", baseline_cycle, baseline_client, args.tokens)
+    run("pooled", pooled_cycle, pooled_client, args.tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,110 @@
 import json
+import os
 from flask import jsonify
 from helpers.managers.ehr_manager import EHRManager
-import redis
+from helpers.utils.config import get_redis
 import uuid
 from datetime import timedelta
 
+TOKEN_TTL = timedelta(minutes=10)
+TOKEN_LEASE_SECONDS = int(os.environ.get("TOKEN_LEASE_SECONDS", 120))
+PATIENT_ID_PREFIX = "MV-P"
+
+# KEYS: access_token, update_token, token_lease. ARGV: want_updates, lease_ms.
+# Moves the token (and its update payload when wanted) into a lease hash, or
+# claims nothing. An unreleased lease simply expires, so a crashed request
+# burns the token rather than leaving it redeemable.
+CLAIM_TOKEN_SCRIPT = """
+local data = redis.call('GET', KEYS[1])
+if not data then return false end
+local updates = false
+if ARGV[1] == '1' then
+    updates = redis.call('GET', KEYS[2])
+    if not updates then return false end
+end
+local ttl = redis.call('PTTL', KEYS[1])
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[3], 'data', data, 'ttl', ttl)
+if updates then
+    -- Only a claimed payload is removed, so release can always restore it
+    redis.call('DEL', KEYS[2])
+    redis.call('HSET', KEYS[3], 'updates', updates)
+end
+redis.call('PEXPIRE', KEYS[3], ARGV[2])
+return {data, updates or ''}
+"""
+
+# KEYS: access_token, update_token, token_lease. Puts a leased token back.
+RELEASE_TOKEN_SCRIPT = """
+local lease = redis.call('HMGET', KEYS[3], 'data', 'ttl', 'updates')
+if not lease[1] then return 0 end
+local ttl = tonumber(lease[2])
+if ttl <= 0 then ttl = 60000 end
+redis.call('SET', KEYS[1], lease[1], 'PX', ttl)
+if lease[3] then redis.call('SET', KEYS[2], lease[3], 'PX', ttl) end
+redis.call('DEL', KEYS[3])
+return 1
+"""
+
+
+class TokenLease:
+    """A claimed single-use token.
+
+    Used as a context manager the token is spent when the block succeeds and
+    handed back (with its remaining TTL) when it raises, so a failed decrypt
+    can be retried with the same OTP.
+    """
+
+    def __init__(self, access_control, token, data, updates=None):
+        self.access_control = access_control
+        self.token = token
+        self.data = data
+        self.updates = updates
+
+    def complete(self):
+        self.access_control.redis.delete(f"token_lease:{self.token}")
+
+    def release(self):
+        return bool(self.access_control.release_script(keys=self.access_control.token_keys(self.token)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.complete()
+        else:
+            self.release()
+        return False
+
 
 class HospitalAccessControl:
-    def __init__(self):
-        self.redis = redis.Redis(host="redis", port=6379, decode_responses=True)
+    def __init__(self, connection=None):
+        # Clients are cheap wrappers around the shared per-process connection pool
+        self.redis = connection or get_redis()
+        self.claim_script = self.redis.register_script(CLAIM_TOKEN_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_TOKEN_SCRIPT)
+
+    @staticmethod
+    def token_keys(token):
+        return [f"access_token:{token}", f"update_token:{token}", f"token_lease:{token}"]
 
-    def generate_token(self, hospital_name, selected_tables, med_vault_id):
+    def generate_token(self, hospital_name, selected_tables, med_vault_id, updates=None):
+        """Stores a new access token, plus its update payload when given, in one round trip."""
         token = str(uuid.uuid4())
-        self.redis.setex(
+        pipe = self.redis.pipeline()
+        pipe.setex(
             f"access_token:{token}",
-            timedelta(minutes=10),
+            TOKEN_TTL,
             json.dumps({
                 "hospital_name": hospital_name,
                 "selected_tables": selected_tables,
                 "med_vault_id": med_vault_id
             })
         )
+        if updates is not None:
+            pipe.setex(f"update_token:{token}", TOKEN_TTL, json.dumps({"updates": updates}))
+        pipe.execute()
         return token
 
     def verify_token(self, token):
@@ -30,26 +114,63 @@ class HospitalAccessControl:
         return None
 
     def invalidate_token(self, token):
-        self.redis.delete(f"access_token:{token}")
+        self.redis.delete(*self.token_keys(token))
 
-    def update_records(self, token, updates):
-        """Update patient data using the provided token and invalidate the token afterward."""
-        hospital_name, allowed_tables = self.verify_token(token)
-        if not hospital_name:
-            return jsonify({"error": "Invalid token."}), 401
+    def claim_token(self, token, with_updates=False):
+        """Atomically claims a single-use token and returns a TokenLease, or None.
 
-        ehr_manager = EHRManager(patient_phone_number=updates.get("patient_phone_number"))
-        updated_tables = []
+        With ``with_updates`` the companion ``update_token`` payload is claimed
+        in the same step and exposed as ``lease.updates``. Concurrent retries
+        of the same OTP get None, so only one of them does the heavy work.
+        """
+        if not token:
+            return None
+        result = self.claim_script(
+            keys=self.token_keys(token),
+            args=["1" if with_updates else "0", TOKEN_LEASE_SECONDS * 1000],
+        )
+        if not result:
+            return None
+        data, updates = result
+        return TokenLease(self, token, json.loads(data), json.loads(updates)["updates"] if updates else None)
+
+    def update_records(self, token, updates):
+        """Applies a batch of records for the tables the token allows, then spends the token.
 
-        for table_name, records in updates.items():
-            if table_name in allowed_tables:
-                for record in records:
-                    ehr_manager.add_record(table_name, record)
-                updated_tables.append(table_name)
+        ``updates`` maps table names to record lists. The patient is the one the
+        token was granted for; an optional ``patient_phone_number`` must match
+        it. The whole batch is validated and deduplicated before one save, and the
+        response reports received/added/duplicate counts per table.
+        """
+        lease = self.claim_token(token)
+        if not lease:
+            return jsonify({"error": "Invalid token."}), 401
 
-        ehr_manager.save_data()
+        with lease:
+            med_vault_id = lease.data["med_vault_id"]
+            if not med_vault_id.startswith(PATIENT_ID_PREFIX):
+                return jsonify({"error": "Token was not granted for a patient."}), 403
+            phone_number = med_vault_id[len(PATIENT_ID_PREFIX):]
+            requested = updates.get("patient_phone_number")
+            if requested is not None and str(requested) != phone_number:
+                return jsonify({"error": "Token was not granted for this patient."}), 403
+            allowed_tables = set(lease.data["selected_tables"])
+            tables = {name: records for name, records in updates.items() if name != "patient_phone_number"}
+            rejected_tables = sorted(set(tables) - allowed_tables)
 
-        # Invalidate the token after updating records
-        self.invalidate_token(token)
+            ehr_manager = EHRManager(patient_phone_number=phone_number)
+            try:
+                counts = ehr_manager.add_records(
+                    {name: records for name, records in tables.items() if name in allowed_tables}
+                )
+            except ValueError as e:
+                # Nothing was applied; hand the token back so the batch can be corrected
+                lease.release()
+                return jsonify({"error": str(e)}), 400
+            ehr_manager.save_data()
 
-        return jsonify({"message": f"Updated tables: {updated_tables}"}), 200
\ No newline at end of file
+        return jsonify({
+            "message": f"Updated tables: {sorted(counts)}",
+            "tables": counts,
+            "rejected_tables": rejected_tables
+        }), 200
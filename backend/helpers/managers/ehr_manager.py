@@ -1,48 +1,223 @@
+import fcntl
+import json
 import os
+import re
+import tempfile
+from contextlib import contextmanager
 
-from flask import json
+import msgspec
+
+from helpers.utils.record_keys import record_dedup_key
+from models.reports import RECORD_TYPES, validate_records
 
 BASE_DIR = "data"
+EHR_JOURNAL_MODE = os.environ.get("EHR_JOURNAL_MODE", "false").lower() == "true"
+EHR_JOURNAL_COMPACT_BYTES = int(os.environ.get("EHR_JOURNAL_COMPACT_BYTES", 4 * 1024 * 1024))
+
+DEFAULT_TABLES = (
+    "TreatmentProgressNotes",
+    "MedicalHistory",
+    "MedicationHistory",
+    "AllergyData",
+    "CoreVitalSigns",
+    "HealthIssues",
+    "ImmunizationRecords",
+    "LaboratoryTestResults",
+    "RadiologyReports",
+)
+
 
 class EHRManager:
-    def __init__(self, patient_phone_number):
+    """File-backed EHR store under ``data/<phone>/``.
+
+    ``<phone>.json`` is the snapshot. Every table keeps a set of record dedup
+    keys (record_dedup_key, the same identity services.ehr_storage uses), so
+    ``add_record`` dedups in O(1). Records added since loading are kept
+    pending until ``save_data``, which holds an exclusive ``flock`` on
+    ``<phone>.lock``, merges whatever other workers wrote in the meantime and
+    then persists:
+
+    * snapshot mode rewrites the snapshot through a temp file and ``os.replace``;
+    * journal mode appends the new records to ``<phone>.journal`` as JSON lines
+      and only folds the journal into the snapshot once it outgrows
+      EHR_JOURNAL_COMPACT_BYTES.
+    """
+
+    def __init__(self, patient_phone_number, journal=EHR_JOURNAL_MODE):
+        # The phone number becomes a path component, so nothing but digits
+        if not isinstance(patient_phone_number, str) or not re.fullmatch(r"[0-9]+", patient_phone_number):
+            raise ValueError("Invalid patient phone number.")
         self.patient_phone_number = patient_phone_number
+        self.journal = journal
         self.patient_dir = os.path.join(BASE_DIR, patient_phone_number)
         self.json_file = os.path.join(self.patient_dir, f"{patient_phone_number}.json")
+        self.journal_file = os.path.join(self.patient_dir, f"{patient_phone_number}.journal")
+        self.lock_file = os.path.join(self.patient_dir, f"{patient_phone_number}.lock")
+        self.pending = []
         self.data = self.load_data()
 
+    @contextmanager
+    def locked(self, exclusive=True):
+        with open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
     def load_data(self):
-        if not os.path.exists(self.patient_dir):
-            os.makedirs(self.patient_dir)
-
-        if not os.path.exists(self.json_file):
-            return {
-                "TreatmentProgressNotes": [],
-                "MedicalHistory": [],
-                "MedicationHistory": [],
-                "AllergyData": [],
-                "CoreVitalSigns": [],
-                "HealthIssues": [],
-                "ImmunizationRecords": [],
-                "LaboratoryTestResults": [],
-                "RadiologyReports": []
-            }
-
-        with open(self.json_file, "r") as file:
-            return json.load(file)
+        os.makedirs(self.patient_dir, exist_ok=True)
+        with self.locked(exclusive=False):
+            self._load()
+        return self.data
+
+    def _load(self):
+        if os.path.exists(self.json_file):
+            with open(self.json_file, "r") as file:
+                self.data = json.load(file)
+        else:
+            self.data = {table: [] for table in DEFAULT_TABLES}
+        self.index = {
+            table: {record_dedup_key(table, record) for record in records}
+            for table, records in self.data.items()
+        }
+        self.snapshot_version = self._snapshot_version()
+        self.journal_offset = 0
+        self._replay_journal()
+
+    def _snapshot_version(self):
+        try:
+            stat = os.stat(self.json_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _replay_journal(self):
+        """Applies journal entries written after ``journal_offset``."""
+        try:
+            with open(self.journal_file, "rb") as file:
+                file.seek(self.journal_offset)
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break  # torn write from a crashed worker; ignore the tail
+                    entry = json.loads(line)
+                    self._insert(entry["table"], entry["record"], record_dedup_key(entry["table"], entry["record"]))
+                    self.journal_offset += len(line)
+        except FileNotFoundError:
+            pass
+
+    def _insert(self, table_name, record, key):
+        if key in self.index.setdefault(table_name, set()):
+            return False
+        self.index[table_name].add(key)
+        self.data.setdefault(table_name, []).append(record)
+        return True
 
     def save_data(self):
-        """Save patient data to JSON file."""
-        with open(self.json_file, "w") as file:
-            json.dump(self.data, file, indent=4)
+        """Persist the records added since loading, merging concurrent writers' changes."""
+        with self.locked():
+            new = self._merge_pending()
+            if not self.journal:
+                self._write_snapshot()
+            elif new:
+                self._append_journal(new)
+                if self.journal_offset > EHR_JOURNAL_COMPACT_BYTES:
+                    self._write_snapshot()
+
+    def compact(self):
+        """Folds the journal, and anything still pending, into the snapshot."""
+        with self.locked():
+            self._merge_pending()
+            self._write_snapshot()
+
+    def _merge_pending(self):
+        """Brings the in-memory data up to date with disk; returns the pending entries to persist.
+
+        Must be called with the exclusive lock held.
+        """
+        new, self.pending = self.pending, []
+        if self._snapshot_version() != self.snapshot_version:
+            # Another worker rewrote the snapshot: start from it and re-apply ours
+            self._load()
+            return [(table, record, key) for table, record, key in new if self._insert(table, record, key)]
+        # Entries other workers journaled meanwhile; a record both of us added
+        # may end up journaled twice, which replay dedups
+        self._replay_journal()
+        return new
+
+    def _append_journal(self, entries):
+        lines = b"".join(
+            json.dumps({"table": table, "record": record}, separators=(",", ":"), default=str).encode() + b"\n"
+            for table, record, _ in entries
+        )
+        with open(self.journal_file, "ab") as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        self.journal_offset += len(lines)
+
+    def _write_snapshot(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.patient_dir, prefix=".ehr-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(self.data, file, separators=(",", ":"), default=str)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.json_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # The snapshot now contains everything journaled so far
+        if os.path.exists(self.journal_file):
+            os.truncate(self.journal_file, 0)
+        self.journal_offset = 0
+        self.snapshot_version = self._snapshot_version()
+
+    def check_records(self, table_name, records):
+        """Returns ``records`` validated and encoded as plain dicts, or raises ValueError."""
+        if table_name not in self.data:
+            raise ValueError(f"Table '{table_name}' does not exist.")
+        if table_name in RECORD_TYPES:
+            return msgspec.to_builtins(validate_records(table_name, records))
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError(f"Records for '{table_name}' must be a list of objects.")
+        return records
 
     def add_record(self, table_name, record):
-        if table_name in self.data:
-            records = self.data[table_name]
-            if record not in records:
+        """Adds ``record`` unless an identical one exists; returns whether it was added."""
+        record = self.check_records(table_name, [record])[0]
+        key = record_dedup_key(table_name, record)
+        if key in self.index[table_name]:
+            return False
+        self.index[table_name].add(key)
+        self.data[table_name].append(record)
+        self.pending.append((table_name, record, key))
+        return True
+
+    def add_records(self, records_by_table):
+        """Adds ``{table: [record, ...]}`` in one step and returns per-table counts.
+
+        Every table and record is validated before anything is applied, so an
+        invalid batch raises ValueError and leaves the manager untouched.
+        Duplicates, within the batch or against stored records, are skipped.
+        """
+        batches = {}
+        for table_name, records in records_by_table.items():
+            records = self.check_records(table_name, records)
+            batches[table_name] = [(record_dedup_key(table_name, record), record) for record in records]
+
+        counts = {}
+        for table_name, keyed in batches.items():
+            index, records, added = self.index[table_name], self.data[table_name], 0
+            for key, record in keyed:
+                if key in index:
+                    continue
+                index.add(key)
                 records.append(record)
-        else:
-            raise ValueError(f"Table '{table_name}' does not exist.")
+                self.pending.append((table_name, record, key))
+                added += 1
+            counts[table_name] = {"received": len(keyed), "added": added, "duplicates": len(keyed) - added}
+        return counts
 
     def get_data(self):
         return self.data
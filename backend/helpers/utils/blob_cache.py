@@ -0,0 +1,110 @@
+import hashlib
+import os
+import threading
+
+EHR_BLOB_CACHE_DIR = os.environ.get("EHR_BLOB_CACHE_DIR", os.path.join("data", "blob_cache"))
+EHR_BLOB_CACHE_MAX_BYTES = int(os.environ.get("EHR_BLOB_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+class BlobCache:
+    """Size-bounded on-disk LRU cache of encrypted EHR blobs keyed by walrus_blob_id.
+
+    Entries are plain files, so the API and the chain-write worker can share
+    one directory. Recency is the file mtime, refreshed on every hit, and the
+    least recently used files are removed once the directory outgrows
+    ``max_bytes``. ``version`` (the snapshot's content hash) is folded into the
+    file name so a blob id reused for changed content never serves stale data.
+
+    The cache also counts the Walrus uploads skipped because content was
+    unchanged, so the saved upload traffic can be watched next to hit rates.
+    """
+
+    def __init__(self, directory=EHR_BLOB_CACHE_DIR, max_bytes=EHR_BLOB_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bytes_served": 0,
+            "evictions": 0,
+            "uploads_skipped": 0,
+            "upload_bytes_saved": 0,
+        }
+
+    def _path(self, blob_id, version):
+        name = hashlib.sha256(f"{blob_id}:{version or ''}".encode()).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, blob_id, version=None):
+        if not blob_id:
+            return None
+        path = self._path(blob_id, version)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.stats["bytes_served"] += len(data)
+        return data
+
+    def put(self, blob_id, data, version=None):
+        if not blob_id or not data:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(blob_id, version)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def record_skipped_upload(self, size):
+        self.stats["uploads_skipped"] += 1
+        self.stats["upload_bytes_saved"] += size
+
+    def _entries(self):
+        try:
+            return [entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith(".tmp")]
+        except FileNotFoundError:
+            return []
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self):
+        # Rescan: other processes write to the same directory
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+            self.stats["evictions"] += 1
+
+    def metrics(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size_bytes": self.size if self.size is not None else self._scan_size(),
+            "max_bytes": self.max_bytes,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0,
+        }
+
+
+blob_cache = BlobCache()
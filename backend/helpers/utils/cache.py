@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self._get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self._set(key, value)
+
+    def get_or_set(self, key, factory, read=None):
+        """Returns the cached value for ``key``, creating it with ``factory`` on a miss.
+
+        ``read`` is applied to the value while the lock is held, so an
+        ``on_evict`` hook can't wipe it before the caller has copied what it
+        needs. ``factory`` runs unlocked.
+        """
+        with self.lock:
+            value = self._get(key)
+            if value is not None:
+                return read(value) if read else value
+        value = factory()
+        with self.lock:
+            result = read(value) if read else value
+            self._set(key, value)
+        return result
+
+    def _get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time.monotonic():
+                self.data.move_to_end(key)
+                self.hits += 1
+                return value
+            self._evict(key)
+        self.misses += 1
+        return default
+
+    def _set(self, key, value):
+        if key in self.data:
+            self._evict(key)
+        self.data[key] = (value, time.monotonic() + self.ttl)
+        while len(self.data) > self.maxsize:
+            self._evict(next(iter(self.data)))
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.data:
+                self._evict(key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.data):
+                self._evict(key)
+
+    def _evict(self, key):
+        value, _ = self.data.pop(key)
+        self.evictions += 1
+        if self.on_evict:
+            self.on_evict(value)
+
+    def __len__(self):
+        return len(self.data)
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
@@ -1,15 +1,42 @@
 import random
 import re
 from datetime import datetime
-from mongoengine import Document, StringField, DateTimeField
+from mongoengine import Document, StringField, DateTimeField, QuerySet
+
+
+class ProjectionQuerySet(QuerySet):
+    """QuerySet with the named field projections declared in a document's ``projections``.
+
+    ``Patient.objects(email=email).projection("contact")`` loads only the
+    contact fields; several names can be combined. Documents loaded this way
+    are partial, so write them back with ``update()`` rather than ``save()``.
+    """
+
+    def projection(self, *names):
+        fields = {"id"}
+        for name in names:
+            fields.update(self._document.projections[name])
+        return self.only(*fields)
+
+    def identity(self):
+        return self.projection("identity")
+
+    def contact(self):
+        return self.projection("contact")
+
+    def crypto(self):
+        return self.projection("crypto")
 
 
 class TimeStamp(Document):
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
 
+    projections = {}
+
     meta = {
         "abstract": True,
+        "queryset_class": ProjectionQuerySet,
     }
 
 
@@ -1,4 +1,5 @@
 import os
+import redis
 from mongoengine import connect
 
 
@@ -10,6 +11,22 @@ class Config:
     TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
     AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
     AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
+    REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+    REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+
+
+# One connection pool per process, shared by every Redis client we create.
+redis_pool = redis.BlockingConnectionPool(
+    host=Config.REDIS_HOST,
+    port=Config.REDIS_PORT,
+    max_connections=Config.REDIS_MAX_CONNECTIONS,
+    decode_responses=True,
+)
+
+
+def get_redis():
+    return redis.Redis(connection_pool=redis_pool)
 
 
 def initialize_db():
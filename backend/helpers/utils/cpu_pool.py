@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", os.cpu_count() or 1))
+CPU_POOL_MAX_PENDING = int(os.environ.get("CPU_POOL_MAX_PENDING", max(1, CPU_POOL_WORKERS) * 8))
+CPU_POOL_TIMEOUT = float(os.environ.get("CPU_POOL_TIMEOUT", 30))
+
+
+class PoolSaturated(Exception):
+    """Raised instead of queueing when the pool already holds ``max_pending`` tasks."""
+
+
+def _timed(fn, args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class CPUPool:
+    """Bounded process pool for CPU-heavy crypto and key derivation.
+
+    ``run`` blocks the calling request thread until the task finishes, but the
+    work itself happens in another process and so doesn't hold this process's
+    GIL. At most ``max_pending`` tasks may be queued or running; beyond that
+    ``run`` raises PoolSaturated so routes can answer 503 instead of piling up.
+    A slot is only freed once its task has finished in the pool, so a caller
+    that gives up after ``timeout`` doesn't make room for more real work.
+    ``workers=0`` runs tasks inline on the calling thread, without any slot
+    accounting; the benchmarks use it as a baseline.
+
+    Tasks must be module-level functions of picklable arguments. Workers are
+    spawned, not forked, so they don't inherit the API's threads and sockets.
+    """
+
+    def __init__(self, workers=CPU_POOL_WORKERS, max_pending=CPU_POOL_MAX_PENDING, timeout=CPU_POOL_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.executor = None
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.rejected = 0
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+            return self.executor
+
+    def run(self, fn, *args):
+        submitted = time.perf_counter()
+        if not self.workers:
+            result, run_time = _timed(fn, args)
+        else:
+            if not self.slots.acquire(blocking=False):
+                with self.lock:
+                    self.rejected += 1
+                raise PoolSaturated(f"CPU pool is full ({self.max_pending} tasks pending)")
+            try:
+                future = self._executor().submit(_timed, fn, args)
+            except BaseException:
+                self.slots.release()
+                raise
+            future.add_done_callback(lambda _: self.slots.release())
+            result, run_time = future.result(self.timeout)
+        self._record(fn.__name__, run_time, time.perf_counter() - submitted - run_time)
+        return result
+
+    def _record(self, name, run_time, wait_time):
+        with self.lock:
+            stats = self.stats.setdefault(name, {"tasks": 0, "run_seconds": 0.0, "max_run_seconds": 0.0,
+                                                 "wait_seconds": 0.0})
+            stats["tasks"] += 1
+            stats["run_seconds"] += run_time
+            stats["max_run_seconds"] = max(stats["max_run_seconds"], run_time)
+            stats["wait_seconds"] += wait_time
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "rejected": self.rejected,
+                "tasks": {
+                    name: {
+                        **stats,
+                        "avg_run_ms": stats["run_seconds"] * 1000 / stats["tasks"],
+                        "avg_wait_ms": stats["wait_seconds"] * 1000 / stats["tasks"],
+                    }
+                    for name, stats in self.stats.items()
+                },
+            }
+
+
+cpu_pool = CPUPool()
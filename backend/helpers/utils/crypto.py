@@ -2,8 +2,30 @@
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+import base64
+import ctypes
+import ctypes.util
 import json
+import os
+import struct
 
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except OSError:
+    _libc = None
+
+# Chunked AEAD stream layout (STREAM construction):
+#   magic | cipher id | chunk size (4 bytes) | nonce prefix (7 bytes)
+#   then per chunk: ciphertext length (4 bytes) | ciphertext + 16-byte tag
+# Each chunk's nonce is prefix | 4-byte counter | last-chunk flag, and the
+# header is authenticated as associated data, so chunks can't be reordered,
+# dropped or truncated without failing decryption.
+STREAM_MAGIC = b"MVE1"
+STREAM_CIPHERS = {"aes-gcm": (0x01, AESGCM), "chacha20-poly1305": (0x02, ChaCha20Poly1305)}
+STREAM_CIPHER_IDS = {cipher_id: aead for cipher_id, aead in STREAM_CIPHERS.values()}
+EHR_CIPHER = os.environ.get("EHR_CIPHER", "aes-gcm")
+EHR_STREAM_CHUNK_SIZE = int(os.environ.get("EHR_STREAM_CHUNK_SIZE", 64 * 1024))
 
 
 def encrypt_ehr_data(ehr_data, sui_public_key_pem):
@@ -28,6 +50,197 @@ def encrypt_ehr_data(ehr_data, sui_public_key_pem):
     return encrypted_ehr, encrypted_key
 
 
+# def encrypt_file(data, sui_public_key_pem):
+#     aes_key = Fernet.generate_key()
+#     fernet = Fernet(aes_key)
+#     encrypted_data = fernet.encrypt(data)
+#     public_key = serialization.load_pem_public_key(sui_public_key_pem)
+#     encrypted_key = public_key.encrypt(
+#         aes_key,
+#         padding.OAEP(
+#             mgf=padding.MGF1(algorithm=hashes.SHA256()),
+#             algorithm=hashes.SHA256(),
+#             label=None
+#         )
+#     )
+#     return encrypted_data, encrypted_key
+
+
+def encrypt_file(data, sui_public_key_bytes):
+    aes_key = generate_stream_key()
+    encrypted_data = b"".join(iter_encrypt([data], aes_key))
+    # Mock public key encryption (Sui uses ED25519, which doesn't support encryption directly)
+    # For testing, store aes_key as-is or use a different encryption scheme
+    encrypted_key = aes_key  # Replace with real encryption in production
+    return encrypted_data, encrypted_key
+
+
+def encrypt_sections(sections, sui_public_key_bytes):
+    """Encrypts each named section separately under one data key.
+
+    Sections can then be decrypted individually with decrypt_file.
+    """
+    aes_key = generate_stream_key()
+    encrypted_sections = {name: b"".join(iter_encrypt([data], aes_key)) for name, data in sections.items()}
+    encrypted_key = aes_key  # Mock public key encryption, see encrypt_file
+    return encrypted_sections, encrypted_key
+
+
+def generate_stream_key():
+    """Returns a url-safe base64 256-bit key, the same shape as a Fernet key."""
+    return base64.urlsafe_b64encode(os.urandom(32))
+
+
+def is_stream_encrypted(encrypted_data):
+    return bytes(encrypted_data[:len(STREAM_MAGIC)]) == STREAM_MAGIC
+
+
+def iter_encrypt(chunks, key, chunk_size=EHR_STREAM_CHUNK_SIZE, cipher=EHR_CIPHER):
+    """Encrypts an iterable of byte strings, yielding the header then one record per chunk.
+
+    Input is re-chunked to ``chunk_size`` and only one chunk is buffered ahead,
+    so memory use doesn't depend on the payload size.
+    """
+    cipher_id, aead_class = STREAM_CIPHERS[cipher]
+    aead = aead_class(base64.urlsafe_b64decode(key))
+    nonce_prefix = os.urandom(7)
+    header = STREAM_MAGIC + bytes([cipher_id]) + struct.pack(">I", chunk_size) + nonce_prefix
+    yield header
+
+    counter = 0
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        # Keep at least one byte back so the final chunk is always flagged as last
+        while len(buffer) > chunk_size:
+            yield _seal(aead, nonce_prefix, counter, False, bytes(buffer[:chunk_size]), header)
+            del buffer[:chunk_size]
+            counter += 1
+    yield _seal(aead, nonce_prefix, counter, True, bytes(buffer), header)
+
+
+def _seal(aead, nonce_prefix, counter, last, plaintext, header):
+    nonce = nonce_prefix + struct.pack(">I", counter) + (b"\x01" if last else b"\x00")
+    ciphertext = aead.encrypt(nonce, plaintext, header)
+    return struct.pack(">I", len(ciphertext)) + ciphertext
+
+
+def iter_decrypt(chunks, key):
+    """Decrypts a stream produced by iter_encrypt, yielding plaintext chunk by chunk."""
+    reader = _ChunkReader(chunks)
+    header = reader.read(len(STREAM_MAGIC) + 12)
+    if header[:len(STREAM_MAGIC)] != STREAM_MAGIC:
+        raise ValueError("Not an encrypted EHR stream")
+    aead_class = STREAM_CIPHER_IDS.get(header[4])
+    if aead_class is None:
+        raise ValueError(f"Unknown EHR stream cipher {header[4]:#04x}")
+    aead = aead_class(base64.urlsafe_b64decode(key))
+    nonce_prefix = header[9:16]
+
+    counter = 0
+    while True:
+        (length,) = struct.unpack(">I", reader.read(4))
+        ciphertext = reader.read(length)
+        last = reader.at_end()
+        nonce = nonce_prefix + struct.pack(">I", counter) + (b"\x01" if last else b"\x00")
+        yield aead.decrypt(nonce, ciphertext, header)
+        if last:
+            return
+        counter += 1
+
+
+class _ChunkReader:
+    """Reads exact byte counts out of an iterable of arbitrarily sized chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def _fill(self, size):
+        while len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return False
+            self.buffer.extend(chunk)
+        return True
+
+    def read(self, size):
+        if not self._fill(size):
+            raise ValueError("Truncated encrypted EHR stream")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def at_end(self):
+        return not self._fill(1)
+
+
+def _iter_file(fileobj, chunk_size):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def encrypt_stream(src, dst, key, chunk_size=EHR_STREAM_CHUNK_SIZE, cipher=EHR_CIPHER):
+    """Encrypts file-like ``src`` into file-like ``dst`` in constant memory."""
+    for record in iter_encrypt(_iter_file(src, chunk_size), key, chunk_size, cipher):
+        dst.write(record)
+
+
+def decrypt_stream(src, dst, key, chunk_size=EHR_STREAM_CHUNK_SIZE):
+    """Decrypts file-like ``src`` into file-like ``dst`` in constant memory."""
+    for plaintext in iter_decrypt(_iter_file(src, chunk_size), key):
+        dst.write(plaintext)
+
+
+# def decrypt_file(encrypted_data, encrypted_key, sui_private_key_pem):
+#     private_key = serialization.load_pem_private_key(sui_private_key_pem, password=None)
+#     aes_key = private_key.decrypt(
+#         encrypted_key,
+#         padding.OAEP(
+#             mgf=padding.MGF1(algorithm=hashes.SHA256()),
+#             algorithm=hashes.SHA256(),
+#             label=None
+#         )
+#     )
+#     fernet = Fernet(aes_key)
+#     return fernet.decrypt(encrypted_data).decode()
+
+
+def decrypt_file(encrypted_data, encrypted_key, sui_private_key_bytes):
+    # Mock decryption (since encrypted_key is aes_key for testing)
+    # Returns raw bytes: payloads may be binary (see helpers/utils/ehr_codec.py)
+    if is_stream_encrypted(encrypted_data):
+        return b"".join(iter_decrypt([bytes(encrypted_data)], encrypted_key))
+    # Blobs written before the AEAD stream format are Fernet tokens
+    fernet = Fernet(encrypted_key)
+    return fernet.decrypt(encrypted_data)
+
+
 def hash_fingerprint(fingerprint_data):
     # Placeholder: Use SDK to hash fingerprint template
     return fingerprint_data  # Replace with actual hashing
+
+
+class LockedBuffer:
+    """Keeps secret key material in mlock'd memory that is zeroed on wipe().
+
+    Locking is best effort: without libc or with a low RLIMIT_MEMLOCK the
+    buffer still works, it just may be swapped out.
+    """
+
+    def __init__(self, secret):
+        self.size = len(secret)
+        self.buffer = ctypes.create_string_buffer(bytes(secret), self.size)
+        self.locked = bool(_libc) and _libc.mlock(self.buffer, ctypes.c_size_t(self.size)) == 0
+
+    def value(self):
+        return self.buffer.raw[:self.size]
+
+    def wipe(self):
+        ctypes.memset(self.buffer, 0, self.size)
+        if self.locked:
+            _libc.munlock(self.buffer, ctypes.c_size_t(self.size))
+            self.locked = False
@@ -0,0 +1,33 @@
+# helpers/utils/crypto_tasks.py
+"""CPU-bound EHR crypto steps, submitted to helpers.utils.cpu_pool.
+
+Each task is a plain function of picklable arguments that does all of its
+encoding and cipher work inside the pool process, so only the inputs and the
+final bytes or values cross the process boundary.
+"""
+from bip_utils import Bip39SeedGenerator, Bip44, Bip44Changes, Bip44Coins
+
+from helpers.utils import ehr_codec
+from helpers.utils.crypto import decrypt_file, encrypt_file, encrypt_sections
+
+
+def encode_and_encrypt(value, sui_public_key):
+    return encrypt_file(ehr_codec.encode(value), sui_public_key)
+
+
+def encode_and_encrypt_sections(ehr_data, sui_public_key):
+    sections = {table: ehr_codec.encode(value) for table, value in ehr_data.items()}
+    return encrypt_sections(sections, sui_public_key)
+
+
+def decrypt_and_decode(items, sui_private_key):
+    """Decrypts ``[(encrypted_data, encrypted_key), ...]`` and returns the decoded values in order."""
+    return [ehr_codec.decode(decrypt_file(data, key, sui_private_key)) for data, key in items]
+
+
+def derive_private_key(mnemonic):
+    """Derives the wallet private key from a mnemonic using bip_utils."""
+    seed = Bip39SeedGenerator(mnemonic).Generate()
+    bip44_ctx = Bip44.FromSeed(seed, Bip44Coins.SOLANA)  # Use SOLANA as a proxy (Sui not in bip_utils)
+    account_ctx = bip44_ctx.Purpose().Coin().Account(0).Change(Bip44Changes.CHAIN_EXT).AddressIndex(0)
+    return account_ctx.PrivateKey().Raw().ToBytes()
@@ -0,0 +1,70 @@
+# helpers/utils/ehr_codec.py
+import json
+import os
+
+import msgpack
+import zstandard
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# The first byte of an encoded payload names its format. Legacy payloads are
+# bare JSON text, which starts with whitespace or a printable character and
+# so never with one of these bytes.
+FORMAT_JSON = 0x00
+FORMAT_MSGPACK = 0x01
+FORMAT_MSGPACK_ZSTD = 0x02
+FORMAT_CBOR = 0x03
+FORMAT_CBOR_ZSTD = 0x04
+
+FORMATS = {
+    "json": FORMAT_JSON,
+    "msgpack": FORMAT_MSGPACK,
+    "msgpack+zstd": FORMAT_MSGPACK_ZSTD,
+    "cbor": FORMAT_CBOR,
+    "cbor+zstd": FORMAT_CBOR_ZSTD,
+}
+FORMAT_BYTES = frozenset(FORMATS.values())
+
+EHR_CODEC = os.environ.get("EHR_CODEC", "msgpack+zstd")
+EHR_ZSTD_LEVEL = int(os.environ.get("EHR_ZSTD_LEVEL", 3))
+
+_compressor = zstandard.ZstdCompressor(level=EHR_ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def encode(value, codec=EHR_CODEC):
+    """Serializes an EHR value to bytes prefixed with its format byte."""
+    fmt = FORMATS[codec]
+    if fmt == FORMAT_JSON:
+        payload = json.dumps(value, separators=(",", ":")).encode()
+    elif fmt in (FORMAT_MSGPACK, FORMAT_MSGPACK_ZSTD):
+        payload = msgpack.packb(value, use_bin_type=True)
+    else:
+        if cbor2 is None:
+            raise ValueError("CBOR codec requires the cbor2 package")
+        payload = cbor2.dumps(value)
+    if fmt in (FORMAT_MSGPACK_ZSTD, FORMAT_CBOR_ZSTD):
+        payload = _compressor.compress(payload)
+    return bytes([fmt]) + payload
+
+
+def decode(data):
+    """Deserializes bytes produced by encode(), or a legacy bare JSON document."""
+    data = bytes(data)
+    if not data or data[0] not in FORMAT_BYTES:
+        return json.loads(data.lstrip())
+    fmt, payload = data[0], data[1:]
+    if fmt in (FORMAT_MSGPACK_ZSTD, FORMAT_CBOR_ZSTD):
+        payload = _decompressor.decompress(payload)
+    if fmt == FORMAT_JSON:
+        return json.loads(payload)
+    if fmt in (FORMAT_MSGPACK, FORMAT_MSGPACK_ZSTD):
+        return msgpack.unpackb(payload, raw=False)
+    if fmt in (FORMAT_CBOR, FORMAT_CBOR_ZSTD):
+        if cbor2 is None:
+            raise ValueError("CBOR payload requires the cbor2 package")
+        return cbor2.loads(payload)
+    raise ValueError(f"Unknown EHR payload format {fmt:#04x}")
@@ -0,0 +1,60 @@
+import os
+from dataclasses import dataclass
+
+from helpers.utils.cache import TTLCache
+
+IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", 4096))
+IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", 60))
+
+IDENTITY_FIELDS = ("id", "name", "email", "med_vault_id", "wallet_id")
+
+
+@dataclass(frozen=True)
+class Identity:
+    """Lightweight projection of a Hospital or Patient used to authenticate requests."""
+    id: object
+    name: str
+    email: str
+    med_vault_id: str = None
+    wallet_id: str = None
+
+    def __str__(self):
+        return self.name
+
+
+# Keyed by (model name, email). Saves and deletes in this process invalidate
+# entries through the model signals; other processes rely on the short TTL.
+identity_cache = TTLCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+
+
+def get_identity(model, email):
+    """Returns the cached Identity for the ``model`` document with ``email``, or None."""
+    if not email:
+        return None
+    key = (model.__name__, email)
+    identity = identity_cache.get(key)
+    if identity is None:
+        document = model.objects(email=email).identity().first()
+        if not document:
+            return None
+        identity = Identity(**{field: getattr(document, field) for field in IDENTITY_FIELDS})
+        identity_cache.set(key, identity)
+    return identity
+
+
+def invalidate_identity(sender, document, **kwargs):
+    """mongoengine post_save/post_delete receiver."""
+    identity_cache.invalidate((sender.__name__, document.email))
+
+
+def invalidate_previous_identity(sender, document, **kwargs):
+    """mongoengine pre_save receiver: drops the entry under the email being replaced.
+
+    post_save only sees the new email, and the old one would otherwise keep
+    resolving until the TTL expires.
+    """
+    if document.pk is None or "email" not in document._get_changed_fields():
+        return
+    previous = sender.objects(pk=document.pk).scalar("email").first()
+    if previous and previous != document.email:
+        identity_cache.invalidate((sender.__name__, previous))
@@ -0,0 +1,33 @@
+import hashlib
+import hmac
+import json
+import os
+
+from models.reports import METADATA_FIELDS, NATURAL_KEYS
+
+# Keyed so stored digests don't reveal low-entropy plaintext
+EHR_HASH_KEY = os.environ.get("MASTER_KEY", "").encode()
+# JSON object of {table: [field, ...]} adding to or overriding NATURAL_KEYS
+EHR_DEDUP_KEYS = {**NATURAL_KEYS, **json.loads(os.environ.get("EHR_DEDUP_KEYS", "{}"))}
+
+
+def keyed_digest(value):
+    """HMAC-SHA256 of ``value``'s canonical JSON form, as hex."""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hmac.new(EHR_HASH_KEY, canonical, hashlib.sha256).hexdigest()
+
+
+def record_dedup_key(table, entry):
+    """Keyed hash identifying a record within ``table``.
+
+    Uses the record's ``id`` when it has one, else the table's natural key
+    from EHR_DEDUP_KEYS, else its whole content without METADATA_FIELDS.
+    """
+    natural = EHR_DEDUP_KEYS.get(table)
+    if entry.get("id"):
+        basis = ["id", entry["id"]]
+    elif natural and all(name in entry for name in natural):
+        basis = ["natural", [entry[name] for name in natural]]
+    else:
+        basis = ["content", {name: item for name, item in entry.items() if name not in METADATA_FIELDS}]
+    return keyed_digest(basis)[:32]
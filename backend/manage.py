@@ -0,0 +1,116 @@
+"""Maintenance commands.
+
+    python manage.py migrate-ehr-sections [--dry-run] [--no-upload]
+    python manage.py migrate-ehr-blobs [--dry-run]
+    python manage.py ensure-indexes [--check]
+    python manage.py explain-queries
+"""
+import argparse
+import sys
+
+from helpers.utils.config import initialize_db
+
+
+def migrate_ehr_sections(args):
+    """Converts monolithic EHR snapshots into per-table encrypted sections."""
+    from models.patient import Patient
+    from services.ehr_queue import enqueue_chain_write
+    from services.ehr_storage import fetch_snapshot, is_sectioned, migrate_to_sections
+
+    migrated = skipped = failed = 0
+    for patient in Patient.objects.projection("ehr").no_cache():
+        blob = fetch_snapshot(patient)
+        if not blob:
+            continue
+        if is_sectioned(blob):
+            skipped += 1
+            continue
+        if args.dry_run:
+            migrated += 1
+            continue
+        try:
+            migrate_to_sections(patient)
+            if not args.no_upload:
+                enqueue_chain_write(patient, requested_by="migration")
+            migrated += 1
+        except Exception as e:
+            failed += 1
+            print(f"Failed to migrate {patient.med_vault_id}: {e}")
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {migrated} EHRs, {skipped} already sectioned, {failed} failed")
+
+
+def migrate_ehr_blobs(args):
+    """Moves EHR snapshots still embedded in Patient documents into the ehr_snapshot collection."""
+    from models.patient import Patient
+    from services.ehr_storage import move_legacy_snapshot
+
+    moved = failed = 0
+    patients = Patient.objects(encrypted_ehr_file__exists=True).only("med_vault_id").no_cache()
+    if args.dry_run:
+        print(f"Would move {patients.count()} EHR snapshots")
+        return
+    for patient in patients:
+        try:
+            if move_legacy_snapshot(patient):
+                moved += 1
+        except Exception as e:
+            failed += 1
+            print(f"Failed to move {patient.med_vault_id}: {e}")
+    print(f"Moved {moved} EHR snapshots, {failed} failed")
+
+
+def ensure_indexes(args):
+    """Builds the declared Mongo indexes, or with --check only reports missing ones."""
+    from models.indexes import ensure_indexes, missing_indexes
+
+    if not args.check:
+        ensure_indexes()
+    missing = missing_indexes()
+    for collection, keys in missing.items():
+        for key in keys:
+            print(f"Missing index on {collection}: {key}")
+    if missing:
+        sys.exit(1)
+    print("All declared indexes present")
+
+
+def explain_queries(args):
+    """Explains every route query and fails if any winning plan is a collection scan."""
+    from models.indexes import collection_scans, route_queries
+
+    scans = collection_scans()
+    for label in scans:
+        print(f"COLLSCAN: {label}")
+    if scans:
+        sys.exit(1)
+    print(f"{len(route_queries())} route queries use indexes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MedVault maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate-ehr-sections", help=migrate_ehr_sections.__doc__)
+    migrate.add_argument("--dry-run", action="store_true", help="only count the EHRs that need migrating")
+    migrate.add_argument("--no-upload", action="store_true", help="don't queue Walrus uploads of the new blobs")
+    migrate.set_defaults(handler=migrate_ehr_sections)
+
+    blobs = commands.add_parser("migrate-ehr-blobs", help=migrate_ehr_blobs.__doc__)
+    blobs.add_argument("--dry-run", action="store_true", help="only count the snapshots that need moving")
+    blobs.set_defaults(handler=migrate_ehr_blobs)
+
+    indexes = commands.add_parser("ensure-indexes", help=ensure_indexes.__doc__)
+    indexes.add_argument("--check", action="store_true", help="don't build anything, exit 1 if indexes are missing")
+    indexes.set_defaults(handler=ensure_indexes)
+
+    explain = commands.add_parser("explain-queries", help=explain_queries.__doc__)
+    explain.set_defaults(handler=explain_queries)
+
+    args = parser.parse_args()
+    initialize_db()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
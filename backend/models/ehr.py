@@ -0,0 +1,70 @@
+import datetime
+
+from mongoengine import Document, StringField, ReferenceField, DateTimeField, BinaryField, IntField, ListField, CASCADE
+
+from models.patient import Patient
+
+
+class EHRSnapshot(Document):
+    """A patient's encrypted base EHR snapshot.
+
+    Kept out of the Patient document so ordinary patient lookups never pull
+    the blob; it is fetched by patient id only when the EHR is read. The
+    matching ``encrypted_key`` and hashes stay on the Patient. ``version``
+    goes up on every write, so a writer can make its update conditional on
+    the snapshot it read.
+    """
+    patient = ReferenceField(Patient, required=True, unique=True, reverse_delete_rule=CASCADE)
+    encrypted_data = BinaryField(required=True)
+    version = IntField(default=0)
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    meta = {
+        "collection": "ehr_snapshot",
+    }
+
+    def __str__(self):
+        return f"EHRSnapshot({self.pk})"
+
+
+class EHRSegment(Document):
+    """Encrypted, append-only delta for one EHR table.
+
+    The patient's base snapshot lives in ``EHRSnapshot``; each
+    confirmed update adds one segment per touched table until compaction folds
+    them back into the snapshot.
+    """
+    patient = ReferenceField(Patient, required=True, reverse_delete_rule=CASCADE)
+    table = StringField(required=True)
+    seq = IntField(required=True)
+    encrypted_data = BinaryField(required=True)
+    encrypted_key = BinaryField(required=True)
+    walrus_blob_id = StringField()
+    created_at = DateTimeField(default=datetime.datetime.now)
+
+    meta = {
+        "indexes": [("patient", "table", "seq")],
+    }
+
+    def __str__(self):
+        return f"{self.table}#{self.seq}"
+
+
+class EHRRecordIndex(Document):
+    """Keyed hashes of the records already stored in one EHR table.
+
+    Lets a confirmed update tell which of its entries are new without
+    decrypting the table's history. Rebuilt whenever a snapshot is written and
+    extended as segments are appended.
+    """
+    patient = ReferenceField(Patient, required=True, reverse_delete_rule=CASCADE)
+    table = StringField(required=True)
+    keys = ListField(StringField())
+
+    meta = {
+        "collection": "ehr_record_index",
+        "indexes": [{"fields": ["patient", "table"], "unique": True}],
+    }
+
+    def __str__(self):
+        return f"EHRRecordIndex({self.table})"
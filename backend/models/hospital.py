@@ -2,6 +2,7 @@ from mongoengine import BinaryField, signals, StringField, Document, EmailField,
 
 from helpers.utils.commons import clean_phone_number
 from helpers.utils.commons import TimeStamp
+from helpers.utils.identity_cache import invalidate_identity, invalidate_previous_identity
 
 
 class Hospital(TimeStamp):
@@ -14,6 +15,18 @@ class Hospital(TimeStamp):
     HPRID = StringField(required=True, unique=True)
     activated = BooleanField(default=False)
     encrypted_mnemonic = BinaryField()
-    
+
+    projections = {
+        "identity": ("name", "email", "med_vault_id", "wallet_id"),
+        "contact": ("name", "email", "phone_number", "wallet_id"),
+        "auth": ("email", "password", "activated"),
+        "crypto": ("wallet_id", "encrypted_mnemonic"),
+    }
+
     def __str__(self):
         return self.name
+
+
+signals.pre_save.connect(invalidate_previous_identity, sender=Hospital)
+signals.post_save.connect(invalidate_identity, sender=Hospital)
+signals.post_delete.connect(invalidate_identity, sender=Hospital)
@@ -0,0 +1,79 @@
+"""Index build/verification and the query plans the routes rely on."""
+from models.ehr import EHRRecordIndex, EHRSegment, EHRSnapshot
+from models.hospital import Hospital
+from models.notifications import Notifications
+from models.patient import FACE_INDEX_HINT, HAS_FACE, NAME_COLLATION, NextOfKin, Patient
+
+INDEXED_MODELS = (Patient, NextOfKin, Hospital, EHRSnapshot, EHRSegment, EHRRecordIndex,
+                  Notifications)
+
+# Indexes an earlier release declared and that are dropped when found.
+# facial_embedding_exists filtered on plain existence, which every patient matches.
+RETIRED_INDEXES = {Patient: ("facial_embedding_exists",)}
+
+
+def ensure_indexes(models=INDEXED_MODELS):
+    """Creates every declared index and drops retired ones; others are left as they are."""
+    for model in models:
+        retired = RETIRED_INDEXES.get(model, ())
+        if retired:
+            collection = model._get_collection()
+            for name in set(retired) & set(collection.index_information()):
+                collection.drop_index(name)
+        model.ensure_indexes()
+
+
+def declared_indexes(model):
+    # index_specs also holds the indexes implied by unique=True fields
+    return [tuple(spec["fields"]) for spec in model._meta.get("index_specs") or []]
+
+
+def missing_indexes(models=INDEXED_MODELS):
+    """Returns ``{collection: [index keys]}`` for declared indexes absent from Mongo."""
+    missing = {}
+    for model in models:
+        collection = model._get_collection()
+        existing = {tuple(info["key"]) for info in collection.index_information().values()}
+        absent = [keys for keys in declared_indexes(model) if tuple(keys) not in existing]
+        if absent:
+            missing[collection.name] = absent
+    return missing
+
+
+def route_queries():
+    """The filters the routes and services run, with placeholder values."""
+    return [
+        ("patient by email", Patient.objects(email="probe@example.com")),
+        ("patient by phone_number", Patient.objects(phone_number="0000000000")),
+        ("patient by med_vault_id", Patient.objects(med_vault_id="MV-P0000000000")),
+        ("patient by wallet_id", Patient.objects(wallet_id="0x0")),
+        ("patient by name", Patient.objects(name="Probe").collation(NAME_COLLATION)),
+        ("patient by fingerprint", Patient.objects(fingerprint_template="0" * 64)),
+        ("patients with faces", Patient.objects(__raw__=HAS_FACE).hint(FACE_INDEX_HINT)),
+        ("next of kin by patient", NextOfKin.objects(patient="0" * 24)),
+        ("hospital by email", Hospital.objects(email="probe@example.com")),
+        ("hospital by phone_number", Hospital.objects(phone_number="0000000000")),
+        ("snapshot by patient", EHRSnapshot.objects(patient="0" * 24)),
+        ("segments by patient and table", EHRSegment.objects(patient="0" * 24, table="Probe").order_by("seq")),
+        ("record index by patient and table", EHRRecordIndex.objects(patient="0" * 24, table="Probe")),
+    ]
+
+
+def plan_stages(plan):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+def collection_scans(queries=None):
+    """Returns the labels of the queries whose winning plan contains a COLLSCAN."""
+    scans = []
+    for label, queryset in queries or route_queries():
+        explain = queryset.explain()
+        winning_plan = explain.get("queryPlanner", explain).get("winningPlan", {})
+        if "COLLSCAN" in plan_stages(winning_plan):
+            scans.append(label)
+    return scans
@@ -1,8 +1,15 @@
 import datetime
 
 from mongoengine import ListField, FloatField, signals, Document, StringField, EmailField, ReferenceField, DateTimeField, DateField, Q, \
-    BinaryField
+    BinaryField, DictField, IntField
 from helpers.utils.commons import TimeStamp
+from helpers.utils.identity_cache import invalidate_identity, invalidate_previous_identity
+
+NAME_COLLATION = {"locale": "en", "strength": 2}
+FACE_INDEX_HINT = "facial_embedding_nonempty"
+# mongoengine stores an empty facial_embedding list on every patient, so
+# plain existence would match them all
+HAS_FACE = {"facial_embedding.0": {"$exists": True}}
 
 
 class Patient(TimeStamp):
@@ -15,17 +22,54 @@ class Patient(TimeStamp):
     DOB = DateField()
     gender = StringField()
     address = StringField()
+    # Legacy home of the EHR snapshot, now stored in models.ehr.EHRSnapshot
     encrypted_ehr_file = BinaryField()
     encrypted_key = BinaryField()
     walrus_blob_id = StringField()
+    ehr_content_hash = StringField()
+    ehr_section_hashes = DictField()
+    # Version of the EHRSnapshot that encrypted_key and the hashes above belong to
+    ehr_version = IntField(default=0)
     encrypted_mnemonic = BinaryField()
     facial_embedding = ListField(FloatField())
     fingerprint_template = StringField()
 
+    # Named field sets for ProjectionQuerySet.projection(). The EHR snapshot
+    # itself lives in models.ehr.EHRSnapshot and is never part of these.
+    projections = {
+        "identity": ("name", "email", "med_vault_id", "wallet_id"),
+        "contact": ("name", "email", "phone_number", "med_vault_id", "wallet_id"),
+        "demographics": ("name", "email", "phone_number", "DOB", "gender", "address"),
+        "auth": ("email", "password"),
+        "crypto": ("wallet_id", "encrypted_mnemonic"),
+        "ehr": ("wallet_id", "med_vault_id", "encrypted_key", "walrus_blob_id", "ehr_content_hash",
+                "ehr_section_hashes", "ehr_version"),
+    }
+
+    # email, phone_number, med_vault_id and wallet_id get unique indexes from
+    # their field definitions.
+    meta = {
+        "indexes": [
+            # Case-insensitive name lookups; queries must use NAME_COLLATION to hit it
+            {"fields": ["name"], "name": "name_ci", "collation": NAME_COLLATION},
+            {"fields": ["fingerprint_template"], "name": "fingerprint_template",
+             "partialFilterExpression": {"fingerprint_template": {"$exists": True}}},
+            # Covers only patients with a stored face. The face index rebuild
+            # filters on HAS_FACE alone, so it names this index via FACE_INDEX_HINT;
+            # the key itself is incidental and keeps the index entries small.
+            {"fields": ["created_at"], "name": FACE_INDEX_HINT, "partialFilterExpression": HAS_FACE},
+        ],
+    }
+
     def __str__(self):
         return self.name
 
 
+signals.pre_save.connect(invalidate_previous_identity, sender=Patient)
+signals.post_save.connect(invalidate_identity, sender=Patient)
+signals.post_delete.connect(invalidate_identity, sender=Patient)
+
+
 class NextOfKin(Document):
     name = StringField(required=True, unique=True)
     email = EmailField(required=True, unique=True)
@@ -35,5 +79,41 @@ class NextOfKin(Document):
     address = StringField(required=False)
     created_at = DateTimeField(default=datetime.datetime.now)
 
+    meta = {
+        "indexes": ["patient"],
+    }
+
     def __str__(self):
         return self.name
+
+
+NEXT_OF_KIN_SUMMARY = ("name", "email", "phone_number", "relationship")
+
+
+def patients_with_next_of_kin(wallet_ids):
+    """Returns ``{wallet_id: patient contact dict}`` with the first next of kin joined in.
+
+    One aggregation round trip for any number of wallets; ``next_of_kin`` is
+    None when the patient has not registered one.
+    """
+    pipeline = [
+        {"$match": {"wallet_id": {"$in": list(wallet_ids)}}},
+        {"$project": {field: 1 for field in Patient.projections["contact"]}},
+        {"$lookup": {
+            "from": NextOfKin._get_collection_name(),
+            "localField": "_id",
+            "foreignField": "patient",
+            "as": "next_of_kin",
+        }},
+        {"$addFields": {"next_of_kin": {"$arrayElemAt": ["$next_of_kin", 0]}}},
+        {"$project": {
+            "_id": 0,
+            **{field: 1 for field in Patient.projections["contact"]},
+            **{f"next_of_kin.{field}": 1 for field in NEXT_OF_KIN_SUMMARY},
+        }},
+    ]
+    patients = {}
+    for row in Patient.objects.aggregate(pipeline):
+        row["next_of_kin"] = row.get("next_of_kin") or None
+        patients[row["wallet_id"]] = row
+    return patients
@@ -1,57 +1,120 @@
-from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Dict
-import uuid
-
-@dataclass
-class BaseData:
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))  # Unique ID for each record
-    created_at: str = field(default_factory=lambda: datetime.now().isoformat())  # Creation timestamp
-    created_by: str = field(default="")  # User who created the record
-    updated_at: str = field(default_factory=lambda: datetime.now().isoformat())  # Last update timestamp
-    updated_by: str = field(default="")  # User who last updated the record
-
-@dataclass
-class AllergyData(BaseData):
+from typing import Dict, List
+
+import msgspec
+
+
+class BaseData(msgspec.Struct, kw_only=True, forbid_unknown_fields=True, omit_defaults=True):
+    """Fields shared by every EHR record.
+
+    Structs are slotted and validated by msgspec's compiled decoder. Missing
+    timestamps are filled by validate_records with one clock read per batch.
+    """
+    id: str = ""  # Record ID supplied by the client; the dedup key when present
+    created_at: str = ""  # Creation timestamp
+    created_by: str = ""  # User who created the record
+    updated_at: str = ""  # Last update timestamp
+    updated_by: str = ""  # User who last updated the record
+
+
+class AllergyData(BaseData, kw_only=True):
     allergens: List[str]
     reactions: List[str]
     severity: str
 
-@dataclass
-class CoreVitalSigns(BaseData):
+
+class CoreVitalSigns(BaseData, kw_only=True):
     blood_pressure: str
     heart_rate: int
     temperature: float
     recorded_at: str
 
-@dataclass
-class HealthIssues(BaseData):
+
+class HealthIssues(BaseData, kw_only=True):
     issues: List[Dict[str, str]]
 
-@dataclass
-class ImmunizationRecords(BaseData):
+
+class ImmunizationRecords(BaseData, kw_only=True):
     vaccinations: List[Dict[str, str]]
 
-@dataclass
-class LaboratoryTestResults(BaseData):
+
+class LaboratoryTestResults(BaseData, kw_only=True):
     results: List[Dict[str, str]]
 
-@dataclass
-class MedicalHistory(BaseData):
+
+class MedicalHistory(BaseData, kw_only=True):
     past_surgeries: List[str]
     chronic_conditions: List[str]
     hospitalizations: List[str]
 
-@dataclass
-class MedicationHistory(BaseData):
-    medications: List[Dict[str, str]]
 
-@dataclass
-class RadiologyReports(BaseData):
+class MedicationHistory(BaseData, kw_only=True):
+    date: str
+    medication: str
+    dose: str = ""
+    hospital: str = ""
+
+
+class RadiologyReports(BaseData, kw_only=True):
     reports: List[Dict[str, str]]
 
-@dataclass
-class TreatmentProgressNotes(BaseData):
+
+class TreatmentProgressNotes(BaseData, kw_only=True):
     doctors_notes: str
     treatment_plans: List[str]
-    follow_up_dates: List[str]
\ No newline at end of file
+    follow_up_dates: List[str]
+
+
+RECORD_TYPES = {
+    cls.__name__: cls
+    for cls in (AllergyData, CoreVitalSigns, HealthIssues, ImmunizationRecords, LaboratoryTestResults,
+                MedicalHistory, MedicationHistory, RadiologyReports, TreatmentProgressNotes)
+}
+RECORD_LIST_TYPES = {name: List[cls] for name, cls in RECORD_TYPES.items()}
+
+# Bookkeeping fields every record carries; they never make two records different
+METADATA_FIELDS = BaseData.__struct_fields__
+TIMESTAMP_FIELDS = ("created_at", "updated_at")
+
+# Fields identifying a record that arrives without an ``id``. Tables not
+# listed here, and records missing these fields, are compared on their whole
+# content minus METADATA_FIELDS.
+NATURAL_KEYS = {
+    "CoreVitalSigns": ("recorded_at",),
+    "MedicationHistory": ("date", "medication"),
+}
+
+
+def validate_records(table, records):
+    """Returns ``records`` as RECORD_TYPES[table] instances, raising ValueError if they don't fit."""
+    try:
+        validated = msgspec.convert(records, RECORD_LIST_TYPES[table])
+    except msgspec.ValidationError as e:
+        raise ValueError(f"Invalid {table} records: {e}") from None
+    now = datetime.now().isoformat()
+    for record in validated:
+        if not record.created_at:
+            record.created_at = now
+        if not record.updated_at:
+            record.updated_at = now
+    return validated
+
+
+def validate_updates(updates):
+    """Validates ``{table: [record, ...]}`` and returns it as plain, encodable values.
+
+    Tables with a record type are checked field by field, stamped with
+    timestamps where missing and stripped of empty defaults; other tables
+    pass through unchanged. Every table name is checked before any record,
+    so a bad batch is rejected as a whole.
+    """
+    if not isinstance(updates, dict):
+        raise ValueError("updates must be an object mapping table names to records")
+    for table in updates:
+        # Table names become segment and index keys, so only plain identifiers are allowed
+        if not isinstance(table, str) or not table.isidentifier():
+            raise ValueError(f"Invalid EHR table name '{table}'")
+    return {
+        table: msgspec.to_builtins(validate_records(table, value)) if table in RECORD_TYPES else value
+        for table, value in updates.items()
+    }
@@ -29,7 +29,7 @@ def send_token():
     if not phone_number:
         return jsonify({"error": "Phone number is required."}), 400
 
-    patient = Patient.objects(phone_number=phone_number).first()
+    patient = Patient.objects(phone_number=phone_number).only("id").first()
     if not patient:
         return jsonify({"error": "Patient with this phone number does not exist."}), 404
 
@@ -60,7 +60,7 @@ def validate_token():
         if not phone_number:
             return jsonify({"error": "Invalid token."}), 400
 
-        patient = Patient.objects(phone_number=phone_number).first()
+        patient = Patient.objects(phone_number=phone_number).only("id").first()
         if not patient:
             return jsonify({"error": "Patient with this phone number does not exist."}), 404
 
@@ -1,33 +1,45 @@
 from datetime import timedelta
+import asyncio
+import os
 import json
 
 import jwt
-from flask import request, jsonify, Blueprint
+from flask import request, jsonify, Blueprint, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token, create_refresh_token
 from mongoengine import NotUniqueError, Q
 from werkzeug.security import check_password_hash, generate_password_hash
-from deepface import DeepFace
-from numpy import linalg
-from routes.patient import encrypt_file
-from services.sui_blockchain import store_to_walrus
+from helpers.utils.crypto import hash_fingerprint
+from services.ehr_queue import enqueue_chain_write, get_job
+from services.ehr_storage import append_updates, read_tables
+from services.face_index import face_index
+from services.face_embedding import EmbeddingQueueFull, face_embedding
 from helpers.managers.access_control import HospitalAccessControl
 from helpers.managers.ehr_manager import EHRManager
 from helpers.utils.commons import confirm_hospital_HPRID
+from helpers.utils.cpu_pool import PoolSaturated
+from helpers.utils.identity_cache import get_identity
 from models.hospital import Hospital
 from helpers.utils.otp_utils import send_otp
 from helpers.utils.commons import clean_phone_number
-from models.patient import Patient
+from models.patient import NAME_COLLATION, Patient, patients_with_next_of_kin
+from models.reports import validate_updates
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import hashes, serialization
-from services.sui_blockchain import create_sui_wallet, get_sui_private_key, get_sui_public_key
+from services.sui_blockchain import create_sui_wallet
 
 hospital = Blueprint('hospital', __name__)
 
+PATIENT_INFO_BATCH_LIMIT = int(os.environ.get("PATIENT_INFO_BATCH_LIMIT", 500))
+BULK_LOOKUP_MAX_ITEMS = int(os.environ.get("BULK_LOOKUP_MAX_ITEMS", 10000))
+BULK_LOOKUP_MAX_BYTES = int(os.environ.get("BULK_LOOKUP_MAX_BYTES", 2 * 1024 * 1024))
+BULK_LOOKUP_KEYS = {"phone_numbers": "phone_number", "emails": "email", "med_vault_ids": "med_vault_id"}
+BULK_LOOKUP_FIELDS = ("wallet_id", "name", "email", "phone_number", "med_vault_id")
+
 
 def get_hospital_by_email(email):
-    return Hospital.objects(email=email).first()
+    return Hospital.objects(email=email).projection("identity", "auth").first()
 
 
 def verify_hospital_password(email, password):
@@ -49,10 +61,10 @@ def register_hospital():
     if not all([name, email, password, HPRID]):
         return jsonify({"error": "All fields are required."}), 400
 
-    if Hospital.objects(Q(email=email)).first():
+    if Hospital.objects(Q(email=email)).only("id").first():
         return jsonify({"error": "Email already registered."}), 400
 
-    if Hospital.objects(Q(phone_number=phone_number)).first():
+    if Hospital.objects(Q(phone_number=phone_number)).only("id").first():
         return jsonify({"error": "Phone number already registered."}), 400
 
     try:
@@ -117,22 +129,25 @@ def login():
 
 @hospital.route("/request-access", methods=["POST"])
 @jwt_required()
-def request_access():
+async def request_access():
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
-        if not hospital:
-            return jsonify({"error": "Hospital not found"}), 404
-
         data = request.json
         patient_email = data.get("patient_email")
-        patient = Patient.objects(email=patient_email).first()
+        # Both lookups are independent, so they overlap instead of queueing
+        hospital, patient = await asyncio.gather(
+            asyncio.to_thread(get_identity, Hospital, current_hospital),
+            asyncio.to_thread(lambda: Patient.objects(email=patient_email).contact().first()),
+        )
+        if not hospital:
+            return jsonify({"error": "Hospital not found"}), 404
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
         selected_tables = data.get("selected_tables", [])
         access_control = HospitalAccessControl()
-        token = access_control.generate_token(hospital.name, selected_tables, patient.med_vault_id)
+        token = await asyncio.to_thread(access_control.generate_token, hospital.name, selected_tables,
+                                        patient.med_vault_id)
         send_otp(patient.phone_number, hospital, token)  # Sends token as OTP
         return jsonify({
             "message": f"Access token sent to {patient.name}"
@@ -141,59 +156,37 @@ def request_access():
         return jsonify({"error": str(e)}), 500
 
 
-# def decrypt_file(encrypted_data, encrypted_key, sui_private_key_pem):
-#     private_key = serialization.load_pem_private_key(sui_private_key_pem, password=None)
-#     aes_key = private_key.decrypt(
-#         encrypted_key,
-#         padding.OAEP(
-#             mgf=padding.MGF1(algorithm=hashes.SHA256()),
-#             algorithm=hashes.SHA256(),
-#             label=None
-#         )
-#     )
-#     fernet = Fernet(aes_key)
-#     return fernet.decrypt(encrypted_data).decode()
-
-
-def decrypt_file(encrypted_data, encrypted_key, sui_private_key_bytes):
-    # Mock decryption (since encrypted_key is aes_key for testing)
-    fernet = Fernet(encrypted_key)
-    return fernet.decrypt(encrypted_data).decode()
-
-
 @hospital.route("/access-ehr", methods=["POST"])
 @jwt_required()
-def access_ehr():
+async def access_ehr():
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
+        hospital = await asyncio.to_thread(get_identity, Hospital, current_hospital)
         if not hospital:
             return jsonify({"error": "Hospital not found"}), 404
 
         data = request.json
         token = data.get("token")
         access_control = HospitalAccessControl()
-        token_data = access_control.verify_token(token)
-        if not token_data:
+        # Claim the single-use token up front so concurrent retries can't both decrypt
+        lease = await asyncio.to_thread(access_control.claim_token, token)
+        if not lease:
             return jsonify({"error": "Invalid or expired token"}), 401
 
-        med_vault_id = token_data["med_vault_id"]
-        patient = Patient.objects(med_vault_id=med_vault_id).first()
-        if not patient:
-            return jsonify({"error": "Patient not found"}), 404
-
-        # Decrypt EHR
-        sui_private_key_pem = get_sui_private_key(patient.wallet_id)  # Implement: fetch securely
-        ehr_json = decrypt_file(patient.encrypted_ehr_file, patient.encrypted_key, sui_private_key_pem)
-        ehr_data = json.loads(ehr_json)
-
-        # Filter by selected tables
-        selected_tables = token_data["selected_tables"]
-        filtered_ehr = {k: ehr_data[k] for k in selected_tables if k in ehr_data}
-
-        # Invalidate token
-        access_control.invalidate_token(token)
+        # The token is spent on success and handed back if decryption fails
+        with lease:
+            med_vault_id = lease.data["med_vault_id"]
+            patient = await asyncio.to_thread(
+                lambda: Patient.objects(med_vault_id=med_vault_id).projection("ehr").first()
+            )
+            if not patient:
+                return jsonify({"error": "Patient not found"}), 404
+
+            # Decrypt the snapshot plus only the delta segments of the selected tables
+            filtered_ehr = await asyncio.to_thread(read_tables, patient, lease.data["selected_tables"])
         return jsonify({"ehr": filtered_ehr}), 200
+    except PoolSaturated as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -201,114 +194,92 @@ def access_ehr():
 @hospital.route("/propose-ehr-update", methods=["POST"])
 @jwt_required()
 def propose_ehr_update():
-    access_control = HospitalAccessControl()
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
+        hospital = get_identity(Hospital, current_hospital)
         if not hospital:
             return jsonify({"error": "Hospital not found"}), 404
 
         data = request.json
         patient_email = data.get("patient_email")
-        updates = data.get("updates", {})
-        patient = Patient.objects(email=patient_email).first()
+        updates = validate_updates(data.get("updates", {}))
+        patient = Patient.objects(email=patient_email).contact().first()
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
         access_control = HospitalAccessControl()
-        token = access_control.generate_token(hospital.name, [], patient.med_vault_id)
-        access_control.redis.setex(
-            f"update_token:{token}",
-            timedelta(minutes=10),
-            json.dumps({"updates": updates})
-        )
+        token = access_control.generate_token(hospital.name, [], patient.med_vault_id, updates=updates)
         send_otp(patient.phone_number, hospital, token)
         return jsonify({
             "message": f"Update confirmation token sent to {patient.name}"
         }), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
 
 @hospital.route("/confirm-ehr-update", methods=["POST"])
 @jwt_required()
-def confirm_ehr_update():
-    access_control = HospitalAccessControl()
+async def confirm_ehr_update():
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
+        hospital = await asyncio.to_thread(get_identity, Hospital, current_hospital)
         if not hospital:
             return jsonify({"error": "Hospital not found"}), 404
 
         data = request.json
         token = data.get("token")
         access_control = HospitalAccessControl()
-        token_data = access_control.verify_token(token)
-        if not token_data:
+        # Claims the access token and its update payload in one round trip
+        lease = await asyncio.to_thread(access_control.claim_token, token, with_updates=True)
+        if not lease:
             return jsonify({"error": "Invalid or expired token"}), 401
 
-        med_vault_id = token_data["med_vault_id"]
-        # updates = json.loads(access_control.redis.get(f"update_token:{token}"))["updates"]
-        token_data = access_control.redis.get(f"update_token:{token}")
-        if not token_data:
-            return jsonify({"error": "Invalid or expired token"}), 400
-        updates = json.loads(token_data)["updates"]
-        patient = Patient.objects(med_vault_id=med_vault_id).first()
-        if not patient:
-            return jsonify({"error": "Patient not found"}), 404
-
-        # Decrypt existing EHR
-        sui_private_key_pem = get_sui_private_key(patient.wallet_id)
-        ehr_json = decrypt_file(patient.encrypted_ehr_file, patient.encrypted_key, sui_private_key_pem)
-        ehr_data = json.loads(ehr_json)
-
-        # Append updates with validation
-        for key, value in updates.items():
-            if key in ehr_data and isinstance(ehr_data[key], list):
-                # Validate new entries
-                valid_entries = [
-                    entry for entry in value
-                    if isinstance(entry, dict) and "date" in entry and "medication" in entry
-                ]
-                # Deduplicate (optional)
-                existing = {(e["date"], e["medication"]) for e in ehr_data[key]}
-                new_entries = [
-                    entry for entry in valid_entries
-                    if (entry["date"], entry["medication"]) not in existing
-                ]
-                ehr_data[key].extend(new_entries)
-            else:
-                ehr_data[key] = value
-
-        # Re-encrypt and store
-        json_data = json.dumps(ehr_data, indent=2).encode()
-        sui_public_key_pem = get_sui_public_key(patient.wallet_id)
-        encrypted_json, encrypted_key = encrypt_file(json_data, sui_public_key_pem)
-        blob_id = store_to_walrus(encrypted_json, patient.wallet_id)
-
-        # Update patient record
-        patient.update(
-            encrypted_ehr_file=encrypted_json,
-            encrypted_key=encrypted_key,
-            walrus_blob_id=blob_id
-        )
+        with lease:
+            med_vault_id = lease.data["med_vault_id"]
+            patient = await asyncio.to_thread(
+                lambda: Patient.objects(med_vault_id=med_vault_id).projection("ehr").first()
+            )
+            if not patient:
+                return jsonify({"error": "Patient not found"}), 404
+
+            # Append the updates as encrypted delta segments, only those get uploaded
+            segments = await asyncio.to_thread(append_updates, patient, lease.updates)
+        if not segments:
+            return jsonify({
+                "message": f"EHR {patient.med_vault_id}.json already contains these updates"
+            }), 200
 
-        # Invalidate tokens
-        access_control.invalidate_token(token)
-        access_control.redis.delete(f"update_token:{token}")
+        job_id = await asyncio.to_thread(enqueue_chain_write, patient, requested_by=hospital.email,
+                                         segments=segments)
         return jsonify({
-            "message": f"EHR updated and stored as {patient.med_vault_id}.json"
-        }), 200
+            "message": f"EHR updated and stored as {patient.med_vault_id}.json, Walrus upload queued",
+            "job_id": job_id
+        }), 202
+    except PoolSaturated as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@hospital.route("/ehr-jobs/<string:job_id>", methods=["GET"])
+@jwt_required()
+def ehr_job_status(job_id):
+    job = get_job(job_id)
+    if not job or job["requested_by"] != get_jwt_identity():
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job_id": job_id, **job}), 200
+
+
 @hospital.route("/find-patient", methods=["POST"])
 @jwt_required()
 def find_patient():
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
+        hospital = get_identity(Hospital, current_hospital)
         if not hospital:
             return jsonify({"error": "Hospital not found"}), 404
 
@@ -316,13 +287,13 @@ def find_patient():
         name = data.get("name")
         phone_number = data.get("phone_number")
 
-        query = Q()
-        if name:
-            query |= Q(name__iexact=name)
+        # Separate queries so each hits its own index: the phone number's unique
+        # index uses the default collation, the name index a case-insensitive one
+        patient = None
         if phone_number:
-            query |= Q(phone_number=clean_phone_number(phone_number))
-
-        patient = Patient.objects(query).first()
+            patient = Patient.objects(phone_number=clean_phone_number(phone_number)).contact().first()
+        if not patient and name:
+            patient = Patient.objects(name=name).collation(NAME_COLLATION).contact().first()
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
@@ -336,53 +307,173 @@ def find_patient():
         return jsonify({"error": str(e)}), 500
 
 
+@hospital.route("/find-patients", methods=["POST"])
+@jwt_required()
+def find_patients():
+    """Bulk find-patient for census reconciliation, streamed back as NDJSON.
+
+    Accepts ``phone_numbers``, ``emails`` and ``med_vault_ids`` lists and emits
+    one line per input value, in input order within each key type.
+    """
+    try:
+        current_hospital = get_jwt_identity()
+        hospital = get_identity(Hospital, current_hospital)
+        if not hospital:
+            return jsonify({"error": "Hospital not found"}), 404
+
+        if request.content_length and request.content_length > BULK_LOOKUP_MAX_BYTES:
+            return jsonify({"error": f"Payload exceeds {BULK_LOOKUP_MAX_BYTES} bytes"}), 413
+        data = request.json or {}
+        lookups = {field: data.get(key) or [] for key, field in BULK_LOOKUP_KEYS.items()}
+        if not all(isinstance(values, list) and all(isinstance(value, str) for value in values)
+                   for values in lookups.values()):
+            return jsonify({"error": f"{', '.join(BULK_LOOKUP_KEYS)} must be lists of strings"}), 400
+        if sum(len(values) for values in lookups.values()) > BULK_LOOKUP_MAX_ITEMS:
+            return jsonify({"error": f"At most {BULK_LOOKUP_MAX_ITEMS} lookups per request"}), 413
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        for field, values in lookups.items():
+            normalized, errors = {}, {}
+            for value in values:
+                try:
+                    normalized[value] = clean_phone_number(value) if field == "phone_number" else value.strip()
+                except ValueError as e:
+                    errors[value] = str(e)
+            if not normalized and not errors:
+                continue
+            matches = {
+                row[field]: row
+                for row in Patient.objects(**{f"{field}__in": list(set(normalized.values()))})
+                .only(*BULK_LOOKUP_FIELDS).as_pymongo()
+            }
+            for value in values:
+                line = {"key": field, "value": value}
+                match = matches.get(normalized.get(value))
+                if value in errors:
+                    line["error"] = errors[value]
+                elif match:
+                    line["patient"] = {name: match.get(name) for name in BULK_LOOKUP_FIELDS}
+                else:
+                    line["error"] = "Patient not found"
+                yield json.dumps(line) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @hospital.route("/find-patient-by-face", methods=["POST"])
 @jwt_required()
 def find_patient_by_face():
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
+        hospital = get_identity(Hospital, current_hospital)
         if not hospital:
             return jsonify({"error": "Hospital not found"}), 404
 
+        k = requested_k()
+        if k is None:
+            return jsonify({"error": "k must be a positive integer"}), 400
         if "image" not in request.files:
             return jsonify({"error": "No image provided"}), 400
         image = request.files["image"]
         try:
-            embedding = DeepFace.represent(image, model_name="Facenet")[0]["embedding"]
+            embedding = face_embedding.represent(image)
+        except EmbeddingQueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
         except Exception as e:
             return jsonify({"error": f"Failed to process image: {str(e)}"}), 400
 
-        patients = Patient.objects(facial_embedding__exists=True)
-        threshold = 10.0
-        for patient in patients:
-            distance = linalg.norm([patient.facial_embedding[i] - embedding[i] for i in range(len(embedding))])
-            if distance < threshold:
-                return jsonify({
-                    "wallet_id": patient.wallet_id,
-                    "name": patient.name,
-                    "email": patient.email,
-                    "phone_number": patient.phone_number
-                }), 200
-        return jsonify({"error": "No match found"}), 404
+        exact = request.form.get("exact", "false").lower() == "true"
+        matches = face_index.search(embedding, k=k, exact=exact)
+        if not matches:
+            return jsonify({"error": "No match found"}), 404
+
+        patients = {str(p.id): p for p in Patient.objects(id__in=[patient_id for patient_id, _ in matches]).contact()}
+        return jsonify({"matches": face_matches_response(matches, patients)}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@hospital.route("/find-patients-by-face", methods=["POST"])
+@jwt_required()
+def find_patients_by_face():
+    """Batch face lookup for mass-casualty intake: one result list per probe image."""
+    try:
+        current_hospital = get_jwt_identity()
+        hospital = get_identity(Hospital, current_hospital)
+        if not hospital:
+            return jsonify({"error": "Hospital not found"}), 404
+
+        k = requested_k()
+        if k is None:
+            return jsonify({"error": "k must be a positive integer"}), 400
+        images = request.files.getlist("images")
+        if not images:
+            return jsonify({"error": "No images provided"}), 400
+
+        futures = face_embedding.represent_many(images)
+        if any(isinstance(future.exception(), EmbeddingQueueFull) for future in futures):
+            return jsonify({"error": "Face embedding queue is full"}), 503, {"Retry-After": "1"}
+        embeddings, errors = [], {}
+        for position, future in enumerate(futures):
+            if future.exception():
+                errors[position] = f"Failed to process image: {str(future.exception())}"
+            else:
+                embeddings.append(future.result())
+
+        exact = request.form.get("exact", "false").lower() == "true"
+        batch_matches = face_index.search_batch(embeddings, k=k, exact=exact) if embeddings else []
+
+        patient_ids = {patient_id for matches in batch_matches for patient_id, _ in matches}
+        patients = {str(p.id): p for p in Patient.objects(id__in=list(patient_ids)).contact()}
+        batch_matches = iter(batch_matches)
+        results = []
+        for position, image in enumerate(images):
+            result = {"image": image.filename}
+            if position in errors:
+                result["error"] = errors[position]
+            else:
+                result["matches"] = face_matches_response(next(batch_matches), patients)
+            results.append(result)
+        return jsonify({"results": results}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def requested_k():
+    """The ``k`` form field of the face lookups, or None unless it is a positive integer."""
+    k = request.form.get("k", "5").strip()
+    return int(k) if k.isascii() and k.isdigit() and int(k) >= 1 else None
+
+
+def face_matches_response(matches, patients):
+    return [
+        {
+            "wallet_id": patients[patient_id].wallet_id,
+            "name": patients[patient_id].name,
+            "email": patients[patient_id].email,
+            "phone_number": patients[patient_id].phone_number,
+            "distance": distance
+        }
+        for patient_id, distance in matches if patient_id in patients
+    ]
+
+
 @hospital.route("/find-patient-by-fingerprint", methods=["POST"])
 @jwt_required()
 def find_patient_by_fingerprint():
     
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
+        hospital = get_identity(Hospital, current_hospital)
         if not hospital:
             return jsonify({"error": "Hospital not found"}), 404
 
         data = request.json
         fingerprint_data = data.get("fingerprint")
         # Placeholder: Implement SDK-specific matching
-        patient = Patient.objects(fingerprint_template=hash_fingerprint(fingerprint_data)).first()
+        patient = Patient.objects(fingerprint_template=hash_fingerprint(fingerprint_data)).contact().first()
         if patient:
             return jsonify({
                 "wallet_id": patient.wallet_id,
@@ -399,49 +490,66 @@ def find_patient_by_fingerprint():
 @jwt_required()
 def get_patient_info(wallet_id):
     try:
-        patient = Patient.objects(wallet_id=wallet_id).first()
+        patient = patients_with_next_of_kin([wallet_id]).get(wallet_id)
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
-        next_of_kin = NextOfKin.objects(patient=patient).first()
-        response = {
-            "name": patient.name,
-            "email": patient.email,
-            "phone_number": patient.phone_number,
-            "next_of_kin": {
-                "name": next_of_kin.name,
-                "email": next_of_kin.email,
-                "phone_number": next_of_kin.phone_number,
-                "relationship": next_of_kin.relationship
-            } if next_of_kin else None
-        }
-        return jsonify(response), 200
+        return jsonify(patient_info_response(patient)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@hospital.route("/get-patients-info", methods=["POST"])
+@jwt_required()
+def get_patients_info():
+    """Batch get-patient-info for ER intake: every wallet resolved in one aggregation."""
+    try:
+        wallet_ids = list(dict.fromkeys((request.json or {}).get("wallet_ids", [])))
+        if not wallet_ids:
+            return jsonify({"error": "wallet_ids is required"}), 400
+        if len(wallet_ids) > PATIENT_INFO_BATCH_LIMIT:
+            return jsonify({"error": f"At most {PATIENT_INFO_BATCH_LIMIT} wallet_ids per request"}), 413
+
+        patients = patients_with_next_of_kin(wallet_ids)
+        return jsonify({
+            "patients": {wallet_id: patient_info_response(patient) for wallet_id, patient in patients.items()},
+            "missing": [wallet_id for wallet_id in wallet_ids if wallet_id not in patients]
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def patient_info_response(patient):
+    return {
+        "name": patient["name"],
+        "email": patient["email"],
+        "phone_number": patient["phone_number"],
+        "next_of_kin": patient["next_of_kin"]
+    }
+
+
 @hospital.route("/request-next-of-kin-access", methods=["POST"])
 @jwt_required()
 def request_next_of_kin_access():
     try:
         current_hospital = get_jwt_identity()
-        hospital = Hospital.objects(email=current_hospital).first()
+        hospital = get_identity(Hospital, current_hospital)
         data = request.json
         wallet_id = data.get("wallet_id")
-        patient = Patient.objects(wallet_id=wallet_id).first()
+        patient = patients_with_next_of_kin([wallet_id]).get(wallet_id)
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
-        next_of_kin = NextOfKin.objects(patient=patient).first()
+        next_of_kin = patient["next_of_kin"]
         if not next_of_kin:
             return jsonify({"error": "No next of kin registered"}), 404
 
         selected_tables = data.get("selected_tables", [])
         access_control = HospitalAccessControl()
-        token = access_control.generate_token(hospital.name, selected_tables, patient.med_vault_id)
-        send_otp(next_of_kin.phone_number, hospital, token)
+        token = access_control.generate_token(hospital.name, selected_tables, patient["med_vault_id"])
+        send_otp(next_of_kin["phone_number"], hospital, token)
         return jsonify({
-            "message": f"Authorization OTP sent to {next_of_kin.name}"
+            "message": f"Authorization OTP sent to {next_of_kin['name']}"
         }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1,4 +1,5 @@
 from datetime import timedelta
+import asyncio
 import json
 
 from cryptography.fernet import Fernet
@@ -11,18 +12,24 @@ from mongoengine import Q
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from helpers.utils.commons import generate_med_vault_id
+from helpers.utils.cpu_pool import PoolSaturated
+from helpers.utils.identity_cache import get_identity
 from models.patient import Patient, NextOfKin
+from models.reports import validate_updates
 from helpers.utils.commons import clean_phone_number
-from services.sui_blockchain import create_sui_wallet, get_sui_public_key, store_to_walrus
+from services.sui_blockchain import create_sui_wallet
+from services.ehr_storage import write_snapshot
+from services.ehr_queue import enqueue_chain_write, get_job
 # from services.sui_blockchain import create_sui_wallet
-from deepface import DeepFace
+from services.face_index import face_index
+from services.face_embedding import EmbeddingQueueFull, face_embedding
 
 
 patient = Blueprint('patient', __name__)
 
 
 def get_patient_by_email(email):
-    return Patient.objects(email=email).first()
+    return Patient.objects(email=email).projection("identity", "auth").first()
 
 
 def verify_patient_password(email, password):
@@ -43,10 +50,10 @@ def register_patient_view():
         if not all([name, email, password, phone_number]):
             return jsonify({"error": "All fields are required."}), 400
 
-        if Patient.objects(email=data['email']).first():
+        if Patient.objects(email=data['email']).only("id").first():
             return jsonify({'error': 'Email already registered'}), 400
 
-        if Patient.objects(Q(phone_number=phone_number)).first():
+        if Patient.objects(Q(phone_number=phone_number)).only("id").first():
             return jsonify({"error": "Phone number already registered."}), 400
 
         # Generate Sui wallet
@@ -100,7 +107,7 @@ def login():
 @jwt_required()
 def profile():
     current_patient = get_jwt_identity()
-    patient = Patient.objects(email=current_patient).first()
+    patient = get_identity(Patient, current_patient)
     if not patient:
         return jsonify({"error": "Patient not found"}), 404
     data = request.json
@@ -108,7 +115,7 @@ def profile():
     dob = data["dob"] or ""
     gender = data["gender"] or ""
     address = data["address"] or ""
-    patient.update(transaction_pin=transaction_pin, DOB=dob, gender=gender, address=address)
+    Patient.objects(id=patient.id).update(transaction_pin=transaction_pin, DOB=dob, gender=gender, address=address)
     return jsonify({
         "status": "success",
         "message": "Profile updated successfully",
@@ -119,7 +126,7 @@ def profile():
 @jwt_required()
 def add_next_of_kin():
     current_patient = get_jwt_identity()
-    patient = Patient.objects(email=current_patient).first()
+    patient = Patient.objects(email=current_patient).identity().first()
     if not patient:
         return jsonify({"error": "Patient not found"}), 404
     try:
@@ -145,46 +152,19 @@ def add_next_of_kin():
         return jsonify({"error": str(e)}), 500
 
 
-# def encrypt_file(data, sui_public_key_pem):
-#     aes_key = Fernet.generate_key()
-#     fernet = Fernet(aes_key)
-#     encrypted_data = fernet.encrypt(data)
-#     public_key = serialization.load_pem_public_key(sui_public_key_pem)
-#     encrypted_key = public_key.encrypt(
-#         aes_key,
-#         padding.OAEP(
-#             mgf=padding.MGF1(algorithm=hashes.SHA256()),
-#             algorithm=hashes.SHA256(),
-#             label=None
-#         )
-#     )
-#     return encrypted_data, encrypted_key
-
-
-def encrypt_file(data, sui_public_key_bytes):
-    aes_key = Fernet.generate_key()
-    fernet = Fernet(aes_key)
-    encrypted_data = fernet.encrypt(data)
-    # Mock public key encryption (Sui uses ED25519, which doesn't support encryption directly)
-    # For testing, store aes_key as-is or use a different encryption scheme
-    encrypted_key = aes_key  # Replace with real encryption in production
-    return encrypted_data, encrypted_key
-
-
 @patient.route("/store-ehr", methods=["POST"])
 @jwt_required()
-def store_ehr():
+async def store_ehr():
     try:
         current_patient = get_jwt_identity()
-        patient = Patient.objects(email=current_patient).first()
-        mnemonic = decrypt_mnemonic(patient.encrypted_mnemonic)  # Custom decryption function
-        public_key_bytes = get_sui_public_key(mnemonic)
-        # Use public_key_bytes for encryption (e.g., with cryptography library)
+        patient = await asyncio.to_thread(
+            lambda: Patient.objects(email=current_patient).projection("demographics", "ehr").first()
+        )
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
         data = request.json
-        ehr_data = {
+        ehr_data = validate_updates({
             "Demographics": {
                 "name": patient.name,
                 "email": patient.email,
@@ -203,39 +183,44 @@ def store_ehr():
             "ImmunizationRecords": data.get("ImmunizationRecords", []),
             "LaboratoryTestResults": data.get("LaboratoryTestResults", []),
             "RadiologyReports": data.get("RadiologyReports", [])
-        }
+        })
 
-        # Create JSON file
-        json_data = json.dumps(ehr_data, indent=2).encode()
         filename = f"{patient.med_vault_id}.json"
 
-        # Encrypt JSON
-        sui_public_key_pem = get_sui_public_key(patient.wallet_id)  # Implement: fetch from wallet
-        encrypted_json, encrypted_key = encrypt_file(json_data, sui_public_key_pem)
-
-        # Store to Walrus
-        blob_id = store_to_walrus(encrypted_json, patient.wallet_id)
-
-        # Update patient record
-        patient.update(
-            encrypted_ehr_file=encrypted_json,
-            encrypted_key=encrypted_key,
-            walrus_blob_id=blob_id
-        )
+        # Commit the encrypted EHR snapshot, then hand the chain write to the worker
+        if not await asyncio.to_thread(write_snapshot, patient, ehr_data):
+            return jsonify({
+                "message": f"EHR {filename} unchanged, nothing to upload",
+                "blob_id": patient.walrus_blob_id
+            }), 200
+        job_id = await asyncio.to_thread(enqueue_chain_write, patient, requested_by=patient.email)
         return jsonify({
-            "message": f"EHR stored as {filename} on Walrus",
-            "blob_id": blob_id
-        }), 200
+            "message": f"EHR stored as {filename}, Walrus upload queued",
+            "job_id": job_id
+        }), 202
+    except PoolSaturated as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@patient.route("/ehr-jobs/<string:job_id>", methods=["GET"])
+@jwt_required()
+def ehr_job_status(job_id):
+    job = get_job(job_id)
+    if not job or job["requested_by"] != get_jwt_identity():
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job_id": job_id, **job}), 200
+
+
 @patient.route("/store-facial-embedding", methods=["POST"])
 @jwt_required()
 def store_facial_embedding():
     try:
         current_patient = get_jwt_identity()
-        patient = Patient.objects(email=current_patient).first()
+        patient = get_identity(Patient, current_patient)
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
@@ -243,11 +228,14 @@ def store_facial_embedding():
             return jsonify({"error": "No image provided"}), 400
         image = request.files["image"]
         try:
-            embedding = DeepFace.represent(image, model_name="Facenet")[0]["embedding"]
+            embedding = face_embedding.represent(image)
+        except EmbeddingQueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
         except Exception as e:
             return jsonify({"error": f"Failed to process image: {str(e)}"}), 400
 
-        patient.update(facial_embedding=embedding)
+        Patient.objects(id=patient.id).update(facial_embedding=embedding)
+        face_index.add(patient.id, embedding)
         return jsonify({"message": "Facial embedding stored successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
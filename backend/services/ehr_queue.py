@@ -0,0 +1,59 @@
+import os
+import time
+import uuid
+
+import redis
+
+from helpers.utils.config import get_redis
+
+CHAIN_WRITE_STREAM = os.environ.get("CHAIN_WRITE_STREAM", "ehr:chain_writes")
+CHAIN_WRITE_GROUP = "chain-writers"
+# Jobs waiting out a retry backoff, scored by the time they may run again
+CHAIN_WRITE_RETRIES = os.environ.get("CHAIN_WRITE_RETRIES", "ehr:chain_write_retries")
+CHAIN_WRITE_MAX_ATTEMPTS = int(os.environ.get("CHAIN_WRITE_MAX_ATTEMPTS", 5))
+JOB_TTL_SECONDS = int(os.environ.get("EHR_JOB_TTL_SECONDS", 7 * 24 * 3600))
+
+
+def ensure_group(connection):
+    try:
+        connection.xgroup_create(CHAIN_WRITE_STREAM, CHAIN_WRITE_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def enqueue_chain_write(patient, requested_by, segments=None, connection=None):
+    """Queues a Walrus/Sui write and returns the job id.
+
+    Without ``segments`` the job uploads the patient's current base snapshot;
+    with them it uploads only those delta segments. The encrypted blobs stay in
+    Mongo, the job only carries ids so a worker always reads committed data.
+    """
+    connection = connection or get_redis()
+    job_id = str(uuid.uuid4())
+    job_key = f"ehr_job:{job_id}"
+    message = {"job_id": job_id, "patient_id": str(patient.id)}
+    if segments:
+        message["segment_ids"] = ",".join(str(segment.id) for segment in segments)
+    pipe = connection.pipeline()
+    pipe.hset(job_key, mapping={
+        "status": "queued",
+        "patient_id": str(patient.id),
+        "med_vault_id": patient.med_vault_id,
+        "requested_by": requested_by,
+        "attempts": 0,
+        "created_at": time.time(),
+    })
+    pipe.expire(job_key, JOB_TTL_SECONDS)
+    pipe.xadd(CHAIN_WRITE_STREAM, message)
+    pipe.execute()
+    return job_id
+
+
+def get_job(job_id, connection=None):
+    connection = connection or get_redis()
+    return connection.hgetall(f"ehr_job:{job_id}") or None
+
+
+def update_job(connection, job_id, **fields):
+    connection.hset(f"ehr_job:{job_id}", mapping={**fields, "updated_at": time.time()})
@@ -0,0 +1,424 @@
+import datetime
+import json
+import os
+import struct
+import time
+
+from mongoengine import NotUniqueError, Q
+
+from helpers.utils import crypto_tasks, ehr_codec
+from helpers.utils.blob_cache import blob_cache
+from helpers.utils.cpu_pool import cpu_pool
+from helpers.utils.record_keys import keyed_digest, record_dedup_key
+from models.ehr import EHRRecordIndex, EHRSegment, EHRSnapshot
+from models.patient import Patient
+from models.reports import TIMESTAMP_FIELDS, validate_updates
+from services.sui_blockchain import get_sui_private_key, get_sui_public_key
+
+EHR_COMPACTION_THRESHOLD = int(os.environ.get("EHR_COMPACTION_THRESHOLD", 20))
+EHR_COMPACTION_ATTEMPTS = int(os.environ.get("EHR_COMPACTION_ATTEMPTS", 3))
+
+# Sectioned snapshot layout: magic, 4-byte header length, JSON header mapping
+# each table to the [offset, length] of its ciphertext, then the ciphertexts.
+SECTIONED_MAGIC = b"MVS1"
+
+
+def encrypt_value(wallet_id, value):
+    return cpu_pool.run(crypto_tasks.encode_and_encrypt, value, get_sui_public_key(wallet_id))
+
+
+def decrypt_value(wallet_id, encrypted_data, encrypted_key):
+    return decrypt_values(wallet_id, [(encrypted_data, encrypted_key)])[0]
+
+
+def decrypt_values(wallet_id, items):
+    """Decrypts many ``(encrypted_data, encrypted_key)`` pairs in a single CPU pool task."""
+    if not items:
+        return []
+    items = [(bytes(data), bytes(key)) for data, key in items]
+    return cpu_pool.run(crypto_tasks.decrypt_and_decode, items, get_sui_private_key(wallet_id))
+
+
+def pack_sections(encrypted_sections):
+    header, body, offset = {}, [], 0
+    for table, ciphertext in encrypted_sections.items():
+        header[table] = [offset, len(ciphertext)]
+        body.append(ciphertext)
+        offset += len(ciphertext)
+    header = json.dumps(header, separators=(",", ":")).encode()
+    return SECTIONED_MAGIC + struct.pack(">I", len(header)) + header + b"".join(body)
+
+
+def is_sectioned(blob):
+    return bool(blob) and bytes(blob[:4]) == SECTIONED_MAGIC
+
+
+def read_section_header(blob):
+    """Returns ``({table: (offset, length)}, body_start)`` for a sectioned snapshot."""
+    (header_length,) = struct.unpack(">I", blob[4:8])
+    body_start = 8 + header_length
+    return json.loads(bytes(blob[8:body_start])), body_start
+
+
+def encrypt_snapshot(wallet_id, ehr_data):
+    """Encrypts every table as its own section and packs them into one blob."""
+    encrypted_sections, encrypted_key = cpu_pool.run(
+        crypto_tasks.encode_and_encrypt_sections, ehr_data, get_sui_public_key(wallet_id)
+    )
+    return pack_sections(encrypted_sections), encrypted_key
+
+
+def decrypt_snapshot(wallet_id, blob, encrypted_key, tables=None):
+    """Decrypts only the requested sections; legacy monolithic blobs are decrypted whole."""
+    if not is_sectioned(blob):
+        ehr_data = decrypt_value(wallet_id, blob, encrypted_key)
+        return ehr_data if tables is None else {k: ehr_data[k] for k in tables if k in ehr_data}
+    header, body_start = read_section_header(blob)
+    selected = [table for table in (header if tables is None else tables) if table in header]
+    sections = []
+    for table in selected:
+        offset, length = header[table]
+        start = body_start + offset
+        sections.append((blob[start:start + length], encrypted_key))
+    return dict(zip(selected, decrypt_values(wallet_id, sections)))
+
+
+def section_digest(value):
+    """Keyed hash of a table's canonical JSON form.
+
+    Record timestamps are left out: validation stamps them on every request,
+    so they would make identical resubmissions look changed.
+    """
+    if isinstance(value, list):
+        value = [
+            {name: item for name, item in entry.items() if name not in TIMESTAMP_FIELDS}
+            if isinstance(entry, dict) else entry
+            for entry in value
+        ]
+    return keyed_digest(value)
+
+
+def content_hash(section_hashes):
+    return keyed_digest(section_hashes)
+
+
+def snapshot_version(patient):
+    """Returns the version of the patient's EHRSnapshot, or None when there is none yet."""
+    snapshot = EHRSnapshot.objects(patient=patient.id).only("version").first()
+    return None if snapshot is None else snapshot.version or 0
+
+
+def at_version(version, field="version"):
+    # Documents written before versioning have no field and count as version 0
+    query = Q(**{field: version})
+    if version == 0:
+        query |= Q(**{f"{field}__exists": False})
+    return query
+
+
+def save_snapshot(patient, ehr_data, expected_version, merge_index=False):
+    """Writes ``ehr_data`` as the snapshot if it is still at ``expected_version``.
+
+    ``expected_version`` is what snapshot_version() returned before
+    ``ehr_data`` was read, None meaning no snapshot existed. Returns False
+    without writing when another writer got there first. With
+    ``merge_index`` the record indexes are only added to, which keeps keys
+    appended concurrently; use it when ``ehr_data`` extends the old snapshot.
+    """
+    section_hashes = {table: section_digest(value) for table, value in ehr_data.items()}
+    encrypted_ehr, encrypted_key = encrypt_snapshot(patient.wallet_id, ehr_data)
+    version = (expected_version or 0) + 1
+    if expected_version is None:
+        try:
+            EHRSnapshot(patient=patient.id, encrypted_data=encrypted_ehr, version=version).save(force_insert=True)
+        except NotUniqueError:
+            return False
+    elif not EHRSnapshot.objects(Q(patient=patient.id) & at_version(expected_version)).update_one(
+        set__encrypted_data=encrypted_ehr,
+        set__version=version,
+        set__updated_at=datetime.datetime.now()
+    ):
+        return False
+    # A newer writer may already have stored its key and hashes
+    Patient.objects(Q(id=patient.id) & (Q(ehr_version__lt=version) | Q(ehr_version__exists=False))).update_one(
+        unset__encrypted_ehr_file=True,
+        set__encrypted_key=encrypted_key,
+        set__walrus_blob_id=None,
+        set__ehr_content_hash=content_hash(section_hashes),
+        set__ehr_section_hashes=section_hashes,
+        set__ehr_version=version
+    )
+    list_tables = [table for table, value in ehr_data.items() if isinstance(value, list)]
+    for table in list_tables:
+        rebuild_record_index(patient, table, ehr_data[table], merge=merge_index)
+    if not merge_index:
+        EHRRecordIndex.objects(patient=patient.id, table__nin=list_tables).delete()
+    return True
+
+
+def write_snapshot(patient, ehr_data):
+    """Replaces the patient's whole EHR with a new encrypted base snapshot.
+
+    Returns False without writing anything when the content is unchanged and
+    already uploaded, so callers can skip the Walrus upload. Segments
+    appended while the snapshot is written are kept on top of it.
+    """
+    section_hashes = {table: section_digest(value) for table, value in ehr_data.items()}
+    if patient.walrus_blob_id and section_hashes == patient.ehr_section_hashes:
+        blob_cache.record_skipped_upload(len(ehr_codec.encode(ehr_data)))
+        return False
+    cutoff = time.time_ns()
+    # ehr_data does not depend on the stored snapshot, so any version may be replaced
+    while not save_snapshot(patient, ehr_data, snapshot_version(patient)):
+        pass
+    EHRSegment.objects(patient=patient, seq__lte=cutoff).delete()
+    return True
+
+
+def append_updates(patient, updates):
+    """Encrypts the new part of each table update as its own delta segment; the snapshot is untouched.
+
+    List tables keep only the entries whose dedup key is not yet in the
+    table's EHRRecordIndex, so the cost is O(new entries) whatever the
+    history size. Any other value replaces the table and is skipped when its
+    digest is unchanged. Tables with nothing new get no segment and therefore
+    no upload. Raises ValueError when ``updates`` fails validation.
+    """
+    # Validates the whole batch up front so a bad table cannot leave earlier segments behind
+    updates = validate_updates(updates)
+    segments = []
+    section_hashes = dict(patient.ehr_section_hashes or {})
+    appended_keys = {}
+    for table, value in updates.items():
+        if isinstance(value, list):
+            keyed = unseen_entries(patient, table, value)
+            if not keyed:
+                blob_cache.record_skipped_upload(len(ehr_codec.encode(value)))
+                continue
+            value = list(keyed.values())
+            appended_keys[table] = list(keyed)
+            # The merged table's digest is only known again after compaction
+            section_hashes.pop(table, None)
+        else:
+            digest = section_digest(value)
+            if digest == section_hashes.get(table):
+                blob_cache.record_skipped_upload(len(ehr_codec.encode(value)))
+                continue
+            section_hashes[table] = digest
+        encrypted_data, encrypted_key = encrypt_value(patient.wallet_id, value)
+        segments.append(EHRSegment(
+            patient=patient,
+            table=table,
+            seq=time.time_ns(),
+            encrypted_data=encrypted_data,
+            encrypted_key=encrypted_key
+        ))
+    if segments:
+        # Written in one insert once every table has been encrypted
+        segments = EHRSegment.objects.insert(segments)
+    for table, keys in appended_keys.items():
+        EHRRecordIndex.objects(patient=patient.id, table=table).update_one(add_to_set__keys=keys, upsert=True)
+    if segments:
+        patient.update(ehr_section_hashes=section_hashes)
+    return segments
+
+
+def unseen_entries(patient, table, entries):
+    """Returns ``{dedup key: entry}`` for the entries not yet stored in ``table``.
+
+    Non-object entries and repeats within ``entries`` are dropped.
+    """
+    keyed = {}
+    for entry in entries:
+        if isinstance(entry, dict):
+            keyed.setdefault(record_dedup_key(table, entry), entry)
+    if not keyed:
+        return {}
+    stored = stored_record_keys(patient, table, list(keyed))
+    return {key: entry for key, entry in keyed.items() if key not in stored}
+
+
+def stored_record_keys(patient, table, candidates):
+    """Returns which of ``candidates`` are in the table's record index.
+
+    The intersection is computed by Mongo, so only matching keys come back.
+    EHRs written before the index existed get theirs built on first use.
+    """
+    rows = list(EHRRecordIndex.objects(patient=patient.id, table=table).aggregate([
+        {"$project": {"hits": {"$setIntersection": ["$keys", candidates]}}},
+    ]))
+    if rows:
+        return set(rows[0]["hits"])
+    return rebuild_record_index(patient, table) & set(candidates)
+
+
+def rebuild_record_index(patient, table, entries=None, merge=False):
+    """Recomputes the table's record index from ``entries`` (decrypting the table when None).
+
+    With ``merge`` the keys are added to the stored ones instead of
+    replacing them, so keys appended in the meantime are never lost.
+    """
+    if entries is None:
+        entries = read_tables(patient, [table]).get(table)
+    keys = {record_dedup_key(table, entry) for entry in entries or [] if isinstance(entry, dict)}
+    if merge:
+        EHRRecordIndex.objects(patient=patient.id, table=table).update_one(add_to_set__keys=list(keys), upsert=True)
+    else:
+        EHRRecordIndex.objects(patient=patient.id, table=table).update_one(set__keys=list(keys), upsert=True)
+    return keys
+
+
+def merge_entries(ehr_data, table, value, seen=None):
+    """Applies one delta segment to ``ehr_data``.
+
+    List entries are appended unless a record with the same dedup key is
+    already in the table; anything else replaces the table. ``seen`` caches
+    each table's keys across the segments of one read.
+    """
+    if not isinstance(value, list) or not isinstance(ehr_data.get(table, []), list):
+        ehr_data[table] = value
+        return
+    entries = ehr_data.setdefault(table, [])
+    seen = {} if seen is None else seen
+    if table not in seen:
+        seen[table] = {record_dedup_key(table, entry) for entry in entries if isinstance(entry, dict)}
+    for entry in value:
+        if not isinstance(entry, dict):
+            continue
+        key = record_dedup_key(table, entry)
+        if key not in seen[table]:
+            seen[table].add(key)
+            entries.append(entry)
+
+
+def fetch_snapshot(patient):
+    """Reads the encrypted snapshot from Mongo, falling back to the legacy Patient field."""
+    blob = EHRSnapshot.objects(patient=patient.id).scalar("encrypted_data").first()
+    if blob is None:
+        blob = Patient.objects(id=patient.id).scalar("encrypted_ehr_file").first()
+    return blob
+
+
+def fetch_snapshots(patient_ids):
+    """Returns ``{patient_id: encrypted snapshot}`` for many patients in two queries at most."""
+    blobs = {
+        str(row["patient"]): row["encrypted_data"]
+        for row in EHRSnapshot.objects(patient__in=list(patient_ids)).only("patient", "encrypted_data").as_pymongo()
+    }
+    missing = [patient_id for patient_id in patient_ids if str(patient_id) not in blobs]
+    if missing:
+        for row in Patient.objects(id__in=missing, encrypted_ehr_file__exists=True).only("encrypted_ehr_file").as_pymongo():
+            blobs[str(row["_id"])] = row["encrypted_ehr_file"]
+    return {patient_id: bytes(blob) for patient_id, blob in blobs.items()}
+
+
+def load_snapshot(patient):
+    """Returns the encrypted snapshot, preferring the local blob cache over Mongo."""
+    blob = blob_cache.get(patient.walrus_blob_id, patient.ehr_content_hash)
+    if blob is not None:
+        return blob
+    blob = fetch_snapshot(patient)
+    if blob and patient.walrus_blob_id:
+        blob_cache.put(patient.walrus_blob_id, blob, patient.ehr_content_hash)
+    return blob
+
+
+def read_tables(patient, tables=None, segments=None):
+    """Returns the decrypted EHR limited to ``tables`` (all tables when None).
+
+    Only the snapshot sections and delta segments of the requested tables are
+    decrypted.
+    """
+    ehr_data = {}
+    blob = load_snapshot(patient)
+    if blob:
+        ehr_data = decrypt_snapshot(patient.wallet_id, blob, patient.encrypted_key, tables)
+
+    if segments is None:
+        segments = EHRSegment.objects(patient=patient)
+        if tables is not None:
+            segments = segments.filter(table__in=list(tables))
+        segments = segments.order_by("seq")
+    segments = list(segments)
+    values = decrypt_values(patient.wallet_id, [(segment.encrypted_data, segment.encrypted_key) for segment in segments])
+    seen = {}
+    for segment, value in zip(segments, values):
+        merge_entries(ehr_data, segment.table, value, seen)
+    return ehr_data
+
+
+def compact(patient, attempts=EHR_COMPACTION_ATTEMPTS):
+    """Folds the current delta segments into a fresh base snapshot.
+
+    The snapshot write only goes through if no one else wrote the snapshot
+    since it was read, and only the folded segments are deleted; segments
+    appended while compaction runs are picked up by the next pass. On a
+    conflict the pass is retried against the new snapshot, up to
+    ``attempts`` times.
+    """
+    for _ in range(attempts):
+        version = snapshot_version(patient)
+        # Key and hashes must belong to the snapshot version we compare against
+        patient = Patient.objects(id=patient.id).projection("ehr").first()
+        if patient is None:
+            return False
+        if (version or 0) != (patient.ehr_version or 0):
+            # Another writer is between its snapshot and Patient updates
+            time.sleep(0.05)
+            continue
+        segments = list(EHRSegment.objects(patient=patient).order_by("seq"))
+        if not segments:
+            return False
+        ehr_data = read_tables(patient, segments=segments)
+        if save_snapshot(patient, ehr_data, version, merge_index=True):
+            EHRSegment.objects(id__in=[segment.id for segment in segments]).delete()
+            return True
+    print(f"EHR compaction for patient {patient.id} gave up after {attempts} conflicting writes")
+    return False
+
+
+def compact_pending(threshold=EHR_COMPACTION_THRESHOLD):
+    """Compacts every patient with at least ``threshold`` outstanding segments."""
+    pending = EHRSegment.objects.aggregate([
+        {"$group": {"_id": "$patient", "segments": {"$sum": 1}}},
+        {"$match": {"segments": {"$gte": threshold}}},
+    ])
+    compacted = []
+    for row in pending:
+        patient = Patient.objects(id=row["_id"]).projection("ehr").first()
+        if patient and compact(patient):
+            compacted.append(patient)
+    return compacted
+
+
+def migrate_to_sections(patient):
+    """Rewrites a legacy monolithic snapshot in the sectioned layout.
+
+    Returns False when the patient has no snapshot, is already migrated or
+    the snapshot changed while it was being rewritten.
+    """
+    version = snapshot_version(patient)
+    blob = fetch_snapshot(patient)
+    if not blob or is_sectioned(blob):
+        return False
+    ehr_data = decrypt_value(patient.wallet_id, blob, patient.encrypted_key)
+    return save_snapshot(patient, ehr_data, version)
+
+
+def move_legacy_snapshot(patient):
+    """Moves a snapshot still stored on the Patient document into EHRSnapshot as is.
+
+    Returns False when there is nothing to move. An existing EHRSnapshot is
+    always newer than the legacy copy, so it is kept.
+    """
+    blob = Patient.objects(id=patient.id).scalar("encrypted_ehr_file").first()
+    if not blob:
+        return False
+    EHRSnapshot.objects(patient=patient.id).update_one(
+        set_on_insert__encrypted_data=blob,
+        set_on_insert__version=0,
+        set_on_insert__updated_at=datetime.datetime.now(),
+        upsert=True
+    )
+    Patient.objects(id=patient.id).update_one(unset__encrypted_ehr_file=True)
+    return True
@@ -0,0 +1,159 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+FACE_MODEL_NAME = os.environ.get("FACE_MODEL_NAME", "Facenet")
+FACE_BATCH_SIZE = int(os.environ.get("FACE_BATCH_SIZE", 16))
+FACE_BATCH_WAIT_MS = int(os.environ.get("FACE_BATCH_WAIT_MS", 10))
+FACE_QUEUE_SIZE = int(os.environ.get("FACE_QUEUE_SIZE", 256))
+FACE_REQUEST_TIMEOUT = float(os.environ.get("FACE_REQUEST_TIMEOUT", 30))
+
+
+class EmbeddingQueueFull(RuntimeError):
+    """Raised instead of waiting when the batch queue is already full."""
+
+
+class FaceEmbeddingService:
+    """Keeps one warm DeepFace model per worker and micro-batches requests.
+
+    Request threads push decoded images onto a bounded queue and wait on a
+    future. A single inference thread drains the queue into batches of up to
+    ``batch_size`` images, waiting at most ``max_wait_ms`` for a batch to fill.
+    When the queue is full, images are rejected with EmbeddingQueueFull at
+    once so routes can answer 503 instead of holding the request thread.
+    """
+
+    def __init__(self, model_name=FACE_MODEL_NAME, batch_size=FACE_BATCH_SIZE,
+                 max_wait_ms=FACE_BATCH_WAIT_MS, queue_size=FACE_QUEUE_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.deepface = None
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "rejected": 0,
+            "batches": 0,
+            "batched_images": 0,
+            "max_batch_size": 0,
+            "last_batch_size": 0,
+        }
+
+    def start(self):
+        """Loads and warms the model, then starts the inference thread."""
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            # Imported here rather than at module level so processes that
+            # merely import the app (e.g. CPU pool workers) never load TensorFlow
+            from deepface import DeepFace
+            self.deepface = DeepFace
+            DeepFace.build_model(self.model_name)
+            DeepFace.represent(
+                np.zeros((160, 160, 3), dtype=np.uint8),
+                model_name=self.model_name,
+                enforce_detection=False,
+            )
+            self.thread = threading.Thread(target=self._run, name="face-embedding", daemon=True)
+            self.thread.start()
+        print(f"Face embedding model {self.model_name} loaded and warmed")
+
+    def represent(self, image, timeout=FACE_REQUEST_TIMEOUT):
+        """Returns the embedding of a single uploaded image."""
+        return self.represent_many([image], timeout=timeout)[0].result()
+
+    def represent_many(self, images, timeout=FACE_REQUEST_TIMEOUT):
+        """Queues several images at once so they land in the same batch.
+
+        Returns one resolved future per image; a failed image carries its own
+        exception instead of failing the whole call.
+        """
+        if not self.thread:
+            self.start()
+        futures = []
+        for image in images:
+            future = Future()
+            try:
+                self.queue.put_nowait((decode_image(image), future))
+                with self.stats_lock:
+                    self.stats["requests"] += 1
+            except queue.Full:
+                with self.stats_lock:
+                    self.stats["rejected"] += 1
+                future.set_exception(EmbeddingQueueFull("Face embedding queue is full"))
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+        for future in futures:
+            future.exception(timeout=timeout)
+        return futures
+
+    def metrics(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        return {
+            **stats,
+            "queue_depth": self.queue.qsize(),
+            "avg_batch_size": stats["batched_images"] / stats["batches"] if stats["batches"] else 0,
+        }
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            with self.stats_lock:
+                self.stats["batches"] += 1
+                self.stats["batched_images"] += len(batch)
+                self.stats["last_batch_size"] = len(batch)
+                self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+            self._embed_batch(batch)
+
+    def _embed_batch(self, batch):
+        images = [image for image, _ in batch]
+        if len(batch) > 1:
+            try:
+                results = self.deepface.represent(images, model_name=self.model_name)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result[0]["embedding"])
+                return
+            except Exception:
+                # One undetectable face fails the whole batch call, so fall
+                # back to per-image inference to isolate the bad image.
+                pass
+        for image, future in batch:
+            if future.done():
+                continue
+            try:
+                future.set_result(self.deepface.represent(image, model_name=self.model_name)[0]["embedding"])
+            except Exception as e:
+                future.set_exception(e)
+
+
+def decode_image(image):
+    """Decodes an uploaded file into the BGR array DeepFace expects."""
+    if isinstance(image, np.ndarray):
+        return image
+    data = image.read() if hasattr(image, "read") else image
+    decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if decoded is None:
+        raise ValueError("Unsupported or corrupt image")
+    return decoded
+
+
+face_embedding = FaceEmbeddingService()
@@ -0,0 +1,362 @@
+import fcntl
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from models.patient import FACE_INDEX_HINT, HAS_FACE, Patient
+
+FACE_INDEX_PATH = os.environ.get("FACE_INDEX_PATH", os.path.join("data", "face_index.npz"))
+FACE_INDEX_NLIST = int(os.environ.get("FACE_INDEX_NLIST", 64))
+FACE_INDEX_NPROBE = int(os.environ.get("FACE_INDEX_NPROBE", 8))
+FACE_MATCH_THRESHOLD = float(os.environ.get("FACE_MATCH_THRESHOLD", 10.0))
+FACE_INDEX_LOG_MAX_BYTES = int(os.environ.get("FACE_INDEX_LOG_MAX_BYTES", 8 * 1024 * 1024))
+
+# Append-log record: patient id length, vector dimension, id, float32 vector
+LOG_RECORD_HEADER = struct.Struct("<HI")
+
+
+class FaceIndex:
+    """IVF-flat index over Patient.facial_embedding backed by a NumPy matrix.
+
+    Vectors live in one contiguous float32 matrix with a parallel array of
+    patient ids. Rows are bucketed by their nearest k-means centroid so a
+    lookup only scans the ``nprobe`` closest buckets instead of every patient.
+    Until there are enough vectors to train centroids every search is exact.
+
+    ``path`` holds a full snapshot, written only by build() and compact().
+    add() appends one record to ``<path>.log`` under an flock on
+    ``<path>.lock``, so a write costs O(1) and workers never share temp files.
+    Before every search and add a process compares the snapshot's identity
+    and the log's size with what it last read. It reloads or replays as
+    needed, so embeddings added by one server worker are visible to the
+    others. The log is folded into a new snapshot once it outgrows
+    FACE_INDEX_LOG_MAX_BYTES; that compaction, and the first centroid
+    training, run on a background thread.
+    """
+
+    def __init__(self, path=FACE_INDEX_PATH, nlist=FACE_INDEX_NLIST, nprobe=FACE_INDEX_NPROBE,
+                 log_max_bytes=FACE_INDEX_LOG_MAX_BYTES):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.lock_path = f"{path}.lock"
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.log_max_bytes = log_max_bytes
+        self.lock = threading.RLock()
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.ids = np.empty(0, dtype=object)
+        self.rows = {}
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.snapshot_version = None
+        self.log_offset = 0
+        self.maintaining = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    @contextmanager
+    def file_lock(self, exclusive=True):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load_or_build(self):
+        """Loads the persisted index, rebuilding it when it is missing or stale."""
+        expected = Patient.objects(__raw__=HAS_FACE).hint(FACE_INDEX_HINT).count()
+        if os.path.exists(self.path):
+            try:
+                self.load()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Failed to load face index: {e}")
+            if len(self) == expected:
+                return self
+        self.build()
+        return self
+
+    def build(self):
+        """Reads every stored embedding from Mongo and retrains the index."""
+        with self.lock, self.file_lock():
+            # Held while reading Mongo so no add() lands in a log this discards
+            ids, vectors = [], []
+            for patient in Patient.objects(__raw__=HAS_FACE).hint(FACE_INDEX_HINT).only("id", "facial_embedding"):
+                ids.append(str(patient.id))
+                vectors.append(patient.facial_embedding)
+            self.ids = np.array(ids, dtype=object)
+            self.vectors = np.asarray(vectors, dtype=np.float32) if ids else np.empty((0, 0), dtype=np.float32)
+            self.rows = {patient_id: row for row, patient_id in enumerate(ids)}
+            self.train()
+            self._write_snapshot()
+        print(f"Built face index with {len(ids)} embeddings")
+
+    def train(self, iterations=10):
+        """Runs k-means over the stored vectors to place the IVF centroids."""
+        self._set_centroids(self._kmeans(self.vectors, iterations))
+
+    def _kmeans(self, vectors, iterations=10):
+        """Returns ``nlist`` centroids for ``vectors``, or None while there are too few to train."""
+        count = len(vectors)
+        if count < self.nlist * 4:
+            return None
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(count, self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = self._nearest_centroids(vectors, centroids, 1)[:, 0]
+            for cluster in range(self.nlist):
+                members = vectors[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+        return centroids
+
+    def _set_centroids(self, centroids):
+        self.centroids = centroids
+        if centroids is None:
+            self.assignments = np.zeros(len(self.ids), dtype=np.int32)
+        else:
+            self.assignments = self._nearest_centroids(self.vectors, centroids, 1)[:, 0].astype(np.int32)
+
+    @staticmethod
+    def _squared_distances(queries, vectors):
+        queries = np.atleast_2d(queries)
+        distances = (
+            np.einsum("ij,ij->i", queries, queries)[:, None]
+            - 2.0 * queries @ vectors.T
+            + np.einsum("ij,ij->i", vectors, vectors)[None, :]
+        )
+        return np.maximum(distances, 0.0)
+
+    def _nearest_centroids(self, queries, centroids, count):
+        distances = self._squared_distances(queries, centroids)
+        count = min(count, len(centroids))
+        return np.argpartition(distances, count - 1, axis=1)[:, :count]
+
+    def add(self, patient_id, embedding):
+        """Inserts or replaces a single patient's embedding by appending it to the log."""
+        vector = np.asarray(embedding, dtype="<f4")
+        encoded_id = str(patient_id).encode()
+        record = LOG_RECORD_HEADER.pack(len(encoded_id), vector.shape[0]) + encoded_id + vector.tobytes()
+        with self.lock:
+            with self.file_lock():
+                with open(self.log_path, "ab") as file:
+                    file.write(record)
+                log_size = os.path.getsize(self.log_path)
+                # Replays our record along with anything other workers appended
+                self._refresh()
+            train = self.centroids is None and len(self.ids) >= self.nlist * 4
+            if train or log_size > self.log_max_bytes:
+                self.maintain_in_background(train)
+
+    def maintain_in_background(self, train=False):
+        """Compacts, after training the centroids when ``train``, on a daemon thread.
+
+        Keeps k-means and the full snapshot write off the request thread. At
+        most one maintenance pass runs per process; a skipped request is
+        picked up by the next add.
+        """
+        with self.lock:
+            if self.maintaining:
+                return
+            self.maintaining = True
+        threading.Thread(target=self._maintain, args=(train,), name="face-index-maintenance", daemon=True).start()
+
+    def _maintain(self, train):
+        try:
+            centroids = None
+            if train:
+                with self.lock:
+                    vectors = self.vectors.copy()
+                # Trained without the lock so searches and adds carry on meanwhile
+                centroids = self._kmeans(vectors)
+            with self.lock, self.file_lock():
+                self._refresh()
+                if centroids is not None:
+                    self._set_centroids(centroids)
+                # Publishes the new centroids, if any, to the other workers
+                self._write_snapshot()
+        except Exception as e:
+            print(f"Face index maintenance failed: {e}")
+        finally:
+            with self.lock:
+                self.maintaining = False
+
+    def _apply(self, patient_id, vector):
+        with self.lock:
+            if not len(self.ids):
+                self.vectors = np.empty((0, vector.shape[0]), dtype=np.float32)
+            cluster = 0
+            if self.centroids is not None:
+                cluster = int(self._nearest_centroids(vector, self.centroids, 1)[0, 0])
+            row = self.rows.get(patient_id)
+            if row is None:
+                self.rows[patient_id] = len(self.ids)
+                self.vectors = np.vstack([self.vectors, vector])
+                self.ids = np.append(self.ids, np.array([patient_id], dtype=object))
+                self.assignments = np.append(self.assignments, np.int32(cluster))
+            else:
+                self.vectors[row] = vector
+                self.assignments[row] = cluster
+
+    def search(self, embedding, k=5, exact=False, threshold=FACE_MATCH_THRESHOLD):
+        """Returns up to ``k`` ``(patient_id, distance)`` pairs nearest to ``embedding``.
+
+        ``exact=True`` skips the IVF buckets and scans every vector, which is
+        the brute-force path used for recall checks.
+        """
+        return self.search_batch([embedding], k=k, exact=exact, threshold=threshold)[0]
+
+    def search_batch(self, embeddings, k=5, exact=False, threshold=FACE_MATCH_THRESHOLD):
+        """Matches several probe embeddings with a single matrix-matrix product.
+
+        Each query only considers rows from its own probed buckets; the rest of
+        the shared candidate block is masked out before ranking.
+        """
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        with self.lock:
+            self.refresh()
+            if not len(self.ids):
+                return [[] for _ in queries]
+            if exact or self.centroids is None:
+                candidates = np.arange(len(self.ids))
+                distances = self._squared_distances(queries, self.vectors)
+            else:
+                probes = self._nearest_centroids(queries, self.centroids, self.nprobe)
+                probe_mask = np.zeros((len(queries), self.nlist), dtype=bool)
+                np.put_along_axis(probe_mask, probes, True, axis=1)
+                candidates = np.flatnonzero(probe_mask.any(axis=0)[self.assignments])
+                distances = self._squared_distances(queries, self.vectors[candidates])
+                distances[~probe_mask[:, self.assignments[candidates]]] = np.inf
+            ids = self.ids[candidates]
+
+        results = []
+        count = min(k, distances.shape[1])
+        if not count:
+            return [[] for _ in queries]
+        top = np.argpartition(distances, count - 1, axis=1)[:, :count]
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_distances = np.sqrt(np.take_along_axis(top_distances, order, axis=1))
+        for rows, row_distances in zip(top, top_distances):
+            results.append([
+                (ids[row], float(distance))
+                for row, distance in zip(rows, row_distances) if distance < threshold
+            ])
+        return results
+
+    def refresh(self):
+        """Picks up the snapshots and log records other processes wrote since the last look."""
+        with self.lock, self.file_lock(exclusive=False):
+            self._refresh()
+
+    def _refresh(self):
+        if self._snapshot_version() != self.snapshot_version:
+            self._load()
+        else:
+            self._replay_log()
+
+    def compact(self):
+        """Folds the log into a fresh snapshot and empties it."""
+        with self.lock, self.file_lock():
+            self._refresh()
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        """Writes the whole index through a per-process temp file and an atomic rename.
+
+        Must be called with both locks held. The log is emptied afterwards;
+        everything in it is now part of the snapshot.
+        """
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".face-index-", suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.savez(
+                    file,
+                    vectors=self.vectors,
+                    ids=self.ids.astype(str),
+                    assignments=self.assignments,
+                    centroids=self.centroids if self.centroids is not None else np.empty((0, 0), dtype=np.float32),
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        open(self.log_path, "wb").close()
+        self.snapshot_version = self._snapshot_version()
+        self.log_offset = 0
+
+    def _snapshot_version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """Loads the snapshot, if any, and replays the whole log on top of it."""
+        with self.lock, self.file_lock(exclusive=False):
+            self._load()
+
+    def _load(self):
+        # The _-prefixed readers and writers expect the caller to hold both locks
+        version = self._snapshot_version()
+        if version is None:
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+            self.ids = np.empty(0, dtype=object)
+            self.rows = {}
+            self.centroids = None
+            self.assignments = np.empty(0, dtype=np.int32)
+        else:
+            with np.load(self.path, allow_pickle=False) as stored:
+                ids = stored["ids"].astype(object)
+                self.vectors = stored["vectors"].astype(np.float32)
+                self.ids = ids
+                self.rows = {patient_id: row for row, patient_id in enumerate(ids)}
+                self.assignments = stored["assignments"].astype(np.int32)
+                self.centroids = stored["centroids"] if stored["centroids"].size else None
+        self.snapshot_version = version
+        self.log_offset = 0
+        self._replay_log()
+
+    def _replay_log(self):
+        """Applies the log records appended after ``log_offset``."""
+        try:
+            size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            size = 0
+        if size < self.log_offset:
+            # A compaction emptied the log; its records are in the new snapshot
+            self._load()
+            return
+        if size == self.log_offset:
+            return
+        with open(self.log_path, "rb") as file:
+            file.seek(self.log_offset)
+            data = file.read(size - self.log_offset)
+        position = 0
+        while position + LOG_RECORD_HEADER.size <= len(data):
+            id_length, dimension = LOG_RECORD_HEADER.unpack_from(data, position)
+            start = position + LOG_RECORD_HEADER.size
+            end = start + id_length + 4 * dimension
+            if end > len(data):
+                break  # record still being written
+            vector = np.frombuffer(data, dtype="<f4", count=dimension, offset=start + id_length)
+            self._apply(data[start:start + id_length].decode(), vector.astype(np.float32))
+            position = end
+        self.log_offset += position
+
+
+face_index = FaceIndex()
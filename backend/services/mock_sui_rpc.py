@@ -0,0 +1,147 @@
+"""Minimal offline stand-in for a Sui JSON-RPC fullnode.
+
+Point SUI_RPC_URL at it to exercise the chain-write pipeline without network
+access::
+
+    python -m services.mock_sui_rpc --port 9000
+    SUI_RPC_URL=http://localhost:9000 python worker.py
+
+Every transaction succeeds and emits a ``blob_id`` event derived from the
+request payload. ``--fail-rate`` makes a fraction of calls error out so the
+worker's retry path can be observed.
+
+``--harness N`` instead pushes N fake blobs through ``store_to_walrus_batch``
+with a stubbed client and transaction, checking that every blob_id is mapped
+back to the right wallet and reporting how many transactions were needed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockSuiRPCHandler(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+    checkpoint = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._reply({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}})
+        calls = payload if isinstance(payload, list) else [payload]
+        responses = [self._handle(call) for call in calls]
+        self._reply(responses if isinstance(payload, list) else responses[0])
+
+    def _handle(self, call):
+        method = call.get("method", "")
+        if random.random() < self.fail_rate:
+            return {"jsonrpc": "2.0", "id": call.get("id"), "error": {"code": -32000, "message": "Injected failure"}}
+        if method == "sui_getLatestCheckpointSequenceNumber":
+            MockSuiRPCHandler.checkpoint += 1
+            result = str(MockSuiRPCHandler.checkpoint)
+        elif method == "rpc.discover":
+            result = {"openrpc": "1.2.6", "info": {"version": "mock"}, "methods": []}
+        else:
+            digest = hashlib.sha256(json.dumps(call.get("params"), sort_keys=True).encode()).hexdigest()
+            result = {
+                "digest": digest,
+                "effects": {"status": {"status": "success"}},
+                "events": [{"parsedJson": {"blob_id": f"mock-{digest[:32]}"}}],
+            }
+        return {"jsonrpc": "2.0", "id": call.get("id"), "result": result}
+
+    def _reply(self, response):
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubEvent:
+    def __init__(self, parsed_json):
+        self.parsed_json = parsed_json
+
+
+class StubResult:
+    def __init__(self, events):
+        self.result_data = type("StubTxResponse", (), {"events": events})()
+        self.result_string = ""
+
+    def is_ok(self):
+        return True
+
+
+class StubTransaction:
+    """Records move calls and answers execute() with one EHRStored event per call."""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def move_call(self, target, arguments):
+        self.calls.append((target, arguments))
+
+    def execute(self, gas_budget):
+        self.client.transactions.append(len(self.calls))
+        return StubResult([
+            StubEvent({
+                "wallet_id": str(wallet_id),
+                "blob_id": f"mock-{hashlib.sha256(data).hexdigest()[:32]}",
+            })
+            for _, (data, wallet_id) in self.calls
+        ])
+
+
+class StubClients:
+    def __init__(self):
+        self.transactions = []
+
+    @contextmanager
+    def client(self):
+        yield self
+
+
+def run_batch_harness(count=1000, batch_size=None):
+    for name in ("MASTER_KEY", "SUI_RPC_URL", "BLOCKCHAIN_PACKAGE_ID"):
+        os.environ.setdefault(name, "ZmFrZS1rZXktZm9yLXRoZS1iYXRjaC1oYXJuZXNzLTA=" if name == "MASTER_KEY" else "mock")
+    from services.sui_blockchain import WALRUS_BATCH_SIZE, store_to_walrus_batch
+
+    batch_size = batch_size or WALRUS_BATCH_SIZE
+    items = [(os.urandom(64), f"0x{index:064x}") for index in range(count)]
+    clients = StubClients()
+    blob_ids = store_to_walrus_batch(items, batch_size=batch_size, clients=clients,
+                                     transaction_factory=StubTransaction)
+    expected = [f"mock-{hashlib.sha256(data).hexdigest()[:32]}" for data, _ in items]
+    assert blob_ids == expected, "blob ids were not mapped back in submission order"
+    print(f"{count} blobs stored in {len(clients.transactions)} transactions (batch size {batch_size})")
+
+
+def serve(host="127.0.0.1", port=9000, fail_rate=0.0):
+    MockSuiRPCHandler.fail_rate = fail_rate
+    server = ThreadingHTTPServer((host, port), MockSuiRPCHandler)
+    print(f"Mock Sui RPC listening on http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--harness", type=int, metavar="N", help="run the batching harness with N blobs and exit")
+    parser.add_argument("--batch-size", type=int)
+    args = parser.parse_args()
+    if args.harness:
+        run_batch_harness(args.harness, args.batch_size)
+    else:
+        serve(args.host, args.port, args.fail_rate)
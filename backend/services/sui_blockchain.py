@@ -1,9 +1,21 @@
+import asyncio
 import os
-from pysui import SyncClient, SuiConfig
+import queue
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pysui import AsyncClient, SyncClient, SuiConfig
+from pysui.sui.sui_builders.get_builders import GetLatestCheckpointSequence
+from pysui.sui.sui_txn import SyncTransaction
+from pysui.sui.sui_types.address import SuiAddress
 from pysui.abstracts.client_keypair import SignatureScheme
 from cryptography.fernet import Fernet
 from models.patient import Patient
-from bip_utils import Bip39SeedGenerator, Bip44, Bip44Coins
+from helpers.utils import crypto_tasks
+from helpers.utils.cache import TTLCache
+from helpers.utils.cpu_pool import cpu_pool
+from helpers.utils.crypto import LockedBuffer
 
 # Ensure environment variables are set
 MASTER_KEY = os.environ.get('MASTER_KEY')
@@ -19,63 +31,231 @@ BLOCKCHAIN_PACKAGE_ID = os.environ.get('BLOCKCHAIN_PACKAGE_ID')
 if not BLOCKCHAIN_PACKAGE_ID:
     raise ValueError("BLOCKCHAIN_PACKAGE_ID environment variable must be set")
 
+SUI_POOL_SIZE = int(os.environ.get('SUI_POOL_SIZE', 4))
+SUI_POOL_TIMEOUT = float(os.environ.get('SUI_POOL_TIMEOUT', 30))
+SUI_HEALTH_CHECK_INTERVAL = float(os.environ.get('SUI_HEALTH_CHECK_INTERVAL', 60))
+
+WALRUS_BATCH_SIZE = int(os.environ.get('WALRUS_BATCH_SIZE', 64))
+WALRUS_GAS_BUDGET_PER_CALL = int(os.environ.get('WALRUS_GAS_BUDGET_PER_CALL', 1000000))
+
+KEY_CACHE_SIZE = int(os.environ.get('KEY_CACHE_SIZE', 4096))
+KEY_CACHE_TTL = int(os.environ.get('KEY_CACHE_TTL', 900))
+CACHE_PRIVATE_KEYS = os.environ.get('CACHE_PRIVATE_KEYS', 'false').lower() == 'true'
+
+# Derived keys keyed by wallet_id. Private keys are only cached when
+# CACHE_PRIVATE_KEYS is set, inside mlock'd buffers wiped on eviction.
+public_key_cache = TTLCache(maxsize=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL)
+private_key_cache = TTLCache(maxsize=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL, on_evict=LockedBuffer.wipe)
+
+def invalidate_wallet_keys(wallet_id):
+    """Drops cached keys for a wallet, e.g. after its mnemonic changes or it is deleted."""
+    public_key_cache.invalidate(wallet_id)
+    private_key_cache.invalidate(wallet_id)
+
+def clear_key_caches():
+    public_key_cache.clear()
+    private_key_cache.clear()
+
+def key_cache_metrics():
+    return {
+        "public_keys": public_key_cache.metrics(),
+        "private_keys": private_key_cache.metrics(),
+    }
+
+class SuiClientManager:
+    """Process-wide SuiConfig plus a fixed pool of keep-alive RPC clients.
+
+    The config is parsed once and shared. Each pooled SyncClient keeps its own
+    HTTP session open, so requests borrow a warm connection instead of paying
+    for config parsing and TLS setup on every transaction. Idle clients that
+    fail a health check are replaced before being handed out again.
+    """
+
+    def __init__(self, rpc_url=SUI_RPC_URL, pool_size=SUI_POOL_SIZE,
+                 health_check_interval=SUI_HEALTH_CHECK_INTERVAL):
+        self.rpc_url = rpc_url
+        self.pool_size = pool_size
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Lock()
+        self._config = None
+        self.pool = queue.Queue(maxsize=pool_size)
+        self.created = 0
+        self.last_checked = {}
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def config(self):
+        if self._config is None:
+            with self.lock:
+                if self._config is None:
+                    self._config = SuiConfig.user_config(rpc_url=self.rpc_url)
+        return self._config
+
+    @contextmanager
+    def client(self, timeout=SUI_POOL_TIMEOUT):
+        """Borrows a pooled SyncClient for the duration of the block."""
+        client = self._acquire(timeout)
+        try:
+            yield client
+        except Exception:
+            # Don't return a client with a possibly broken session to the pool.
+            self._discard(client)
+            raise
+        else:
+            self.pool.put(client)
+
+    def _acquire(self, timeout):
+        try:
+            client = self.pool.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                if self.created < self.pool_size:
+                    self.created += 1
+                    return self._new_client()
+            client = self.pool.get(timeout=timeout)
+        if time.monotonic() - self.last_checked.get(id(client), 0) > self.health_check_interval:
+            if not self._is_healthy(client):
+                self._discard(client)
+                with self.lock:
+                    self.created += 1
+                return self._new_client()
+        return client
+
+    def _new_client(self):
+        client = SyncClient(self.config)
+        self.last_checked[id(client)] = time.monotonic()
+        return client
+
+    def _discard(self, client):
+        self.last_checked.pop(id(client), None)
+        with self.lock:
+            self.created -= 1
+
+    def _is_healthy(self, client):
+        try:
+            healthy = client.execute(GetLatestCheckpointSequence()).is_ok()
+        except Exception:
+            healthy = False
+        if healthy:
+            self.last_checked[id(client)] = time.monotonic()
+        return healthy
+
+    def health_check(self):
+        """Pings every idle pooled client and replaces the ones that fail."""
+        idle = []
+        while True:
+            try:
+                idle.append(self.pool.get_nowait())
+            except queue.Empty:
+                break
+        healthy = 0
+        for client in idle:
+            if self._is_healthy(client):
+                healthy += 1
+                self.pool.put(client)
+            else:
+                self._discard(client)
+        return {"rpc_url": self.rpc_url, "pool_size": self.pool_size, "open": self.created,
+                "idle_checked": len(idle), "healthy": healthy}
+
+    def async_client(self):
+        """Returns an AsyncClient bound to the running event loop, for use off the request thread."""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            client = self.async_clients.get(loop)
+            if client is None:
+                client = self.async_clients[loop] = AsyncClient(self.config)
+        return client
+
+
+sui_clients = SuiClientManager()
+
 def decrypt_mnemonic(encrypted_mnemonic):
     """Decrypts the stored mnemonic using Fernet."""
     return fernet.decrypt(encrypted_mnemonic).decode()
 
 def create_sui_wallet():
     """Creates a new Sui wallet, generates a mnemonic, and returns the address and encrypted mnemonic."""
-    config = SuiConfig.user_config(rpc_url=SUI_RPC_URL)
     scheme = SignatureScheme.ED25519
-    mnemonic, address = config.create_new_keypair_and_address(scheme)
+    mnemonic, address = sui_clients.config.create_new_keypair_and_address(scheme)
     encrypted_mnemonic = fernet.encrypt(mnemonic.encode())
     return address, encrypted_mnemonic
 
 def get_sui_keypair_from_mnemonic(mnemonic):
     """Derives a Sui address from a mnemonic using pysui."""
-    config = SuiConfig.user_config(rpc_url=SUI_RPC_URL)
     scheme = SignatureScheme.ED25519
     derivation_path = "m/44'/784'/0'/0'/0'"  # Standard Sui derivation path
-    _, address = config.recover_keypair_and_address(scheme, mnemonic, derivation_path)
+    _, address = sui_clients.config.recover_keypair_and_address(scheme, mnemonic, derivation_path)
     return address
 
-def get_sui_public_key(wallet_id):
-    """Retrieves the public key (address) for a patient's wallet."""
-    patient = Patient.objects(wallet_id=wallet_id).first()
+def get_wallet_mnemonic(wallet_id):
+    patient = Patient.objects(wallet_id=wallet_id).only("encrypted_mnemonic").first()
     if not patient:
         raise ValueError("Patient not found")
-    mnemonic = decrypt_mnemonic(patient.encrypted_mnemonic)
-    return get_sui_keypair_from_mnemonic(mnemonic)
+    return decrypt_mnemonic(patient.encrypted_mnemonic)
+
+def get_sui_public_key(wallet_id):
+    """Retrieves the public key (address) for a patient's wallet."""
+    return public_key_cache.get_or_set(
+        wallet_id,
+        lambda: get_sui_keypair_from_mnemonic(get_wallet_mnemonic(wallet_id))
+    )
+
+def derive_private_key(mnemonic):
+    """Derives the wallet private key from a mnemonic in the CPU pool."""
+    return cpu_pool.run(crypto_tasks.derive_private_key, mnemonic)
 
 def get_sui_private_key(wallet_id):
     """Retrieves the private key for a patient's wallet using bip_utils."""
-    patient = Patient.objects(wallet_id=wallet_id).first()
-    if not patient:
-        raise ValueError("Patient not found")
-    mnemonic = decrypt_mnemonic(patient.encrypted_mnemonic)
-    # Derive private key using bip_utils
-    seed = Bip39SeedGenerator(mnemonic).Generate()
-    bip44_ctx = Bip44.FromSeed(seed, Bip44Coins.SOLANA)  # Use SOLANA as a proxy (Sui not in bip_utils)
-    account_ctx = bip44_ctx.Purpose().Coin().Account(0).Change(Bip44Changes.CHAIN_EXT).AddressIndex(0)
-    private_key = account_ctx.PrivateKey().Raw().ToBytes()
-    return private_key
+    if not CACHE_PRIVATE_KEYS:
+        return derive_private_key(get_wallet_mnemonic(wallet_id))
+    # Copy the key out under the cache lock; an eviction wipes the buffer
+    return private_key_cache.get_or_set(
+        wallet_id,
+        lambda: LockedBuffer(derive_private_key(get_wallet_mnemonic(wallet_id))),
+        read=LockedBuffer.value
+    )
 
 def store_to_walrus(encrypted_data, wallet_id):
     """Stores encrypted EHR data on Walrus via the Sui smart contract."""
-    config = SuiConfig.user_config(rpc_url=SUI_RPC_URL)
-    client = SyncClient(config)
-    tx_result = client.execute(
-        package_id=BLOCKCHAIN_PACKAGE_ID,
-        module_name="ehr_module",
-        function_name="store_ehr",
-        type_args=[],
-        args=[encrypted_data, wallet_id],
-        gas_budget=1000000
-    )
-    if tx_result.is_ok():
-        effects = tx_result.result_data.effects
-        for event in effects.events:
-            if "blob_id" in event:
-                return event["blob_id"].encode()
-        return b"mock_blob_id"  # Fallback for testing
-    raise Exception(f"Failed to store to Walrus: {tx_result.result_string}")
+    return store_to_walrus_batch([(encrypted_data, wallet_id)])[0]
+
+def store_to_walrus_batch(items, batch_size=WALRUS_BATCH_SIZE, clients=None, transaction_factory=SyncTransaction):
+    """Stores many ``(encrypted_data, wallet_id)`` blobs with as few transactions as possible.
+
+    Up to ``batch_size`` ``store_ehr`` move calls are packed into a single
+    programmable transaction block. Each call emits one ``EHRStored`` event,
+    in call order, so the events are mapped back to ``items`` by position.
+    Returns the blob ids in the same order as ``items``.
+    """
+    clients = clients or sui_clients
+    blob_ids = []
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        with clients.client() as client:
+            txn = transaction_factory(client=client)
+            for encrypted_data, wallet_id in chunk:
+                txn.move_call(
+                    target=f"{BLOCKCHAIN_PACKAGE_ID}::ehr_module::store_ehr",
+                    arguments=[bytes(encrypted_data), SuiAddress(wallet_id)],
+                )
+            tx_result = txn.execute(gas_budget=str(WALRUS_GAS_BUDGET_PER_CALL * len(chunk)))
+        if not tx_result.is_ok():
+            raise Exception(f"Failed to store to Walrus: {tx_result.result_string}")
+        blob_ids.extend(map_stored_events(tx_result.result_data.events, chunk))
+    return blob_ids
+
+def map_stored_events(events, items):
+    """Pairs the EHRStored events of one transaction with the items that produced them."""
+    stored = [event.parsed_json for event in events or [] if "blob_id" in (event.parsed_json or {})]
+    if not stored:
+        return ["mock_blob_id"] * len(items)  # Fallback for testing
+    if len(stored) != len(items):
+        raise Exception(f"Expected {len(items)} EHRStored events, got {len(stored)}")
+    blob_ids = []
+    for (_, wallet_id), event in zip(items, stored):
+        if event.get("wallet_id", wallet_id) != wallet_id:
+            raise Exception(f"EHRStored event for {event['wallet_id']} does not match {wallet_id}")
+        blob_id = event["blob_id"]
+        blob_ids.append(bytes(blob_id).decode() if isinstance(blob_id, list) else str(blob_id))
+    return blob_ids
@@ -0,0 +1,189 @@
+"""Chain-write worker: drains queued EHR jobs into Walrus/Sui.
+
+Run with ``python worker.py``. Several workers can share the consumer group;
+jobs left pending by a crashed worker are reclaimed after CHAIN_WRITE_CLAIM_IDLE_MS.
+Failed uploads wait out their backoff in the CHAIN_WRITE_RETRIES sorted set, so
+one failure never stalls the loop.
+Every EHR_COMPACTION_INTERVAL seconds the worker also folds accumulated EHR
+delta segments back into their patients' base snapshots.
+"""
+import json
+import os
+import socket
+import time
+
+from helpers.utils.blob_cache import blob_cache
+from helpers.utils.config import initialize_db
+from models.ehr import EHRSegment
+from models.patient import Patient
+from services.ehr_queue import (
+    CHAIN_WRITE_GROUP, CHAIN_WRITE_MAX_ATTEMPTS, CHAIN_WRITE_RETRIES, CHAIN_WRITE_STREAM,
+    enqueue_chain_write, ensure_group, get_redis, update_job,
+)
+from services.ehr_storage import compact_pending, fetch_snapshots
+from services.sui_blockchain import WALRUS_BATCH_SIZE, store_to_walrus_batch
+
+CHAIN_WRITE_BATCH_SIZE = int(os.environ.get("CHAIN_WRITE_BATCH_SIZE", WALRUS_BATCH_SIZE))
+CHAIN_WRITE_LINGER_MS = int(os.environ.get("CHAIN_WRITE_LINGER_MS", 200))
+CHAIN_WRITE_BLOCK_MS = int(os.environ.get("CHAIN_WRITE_BLOCK_MS", 5000))
+CHAIN_WRITE_CLAIM_IDLE_MS = int(os.environ.get("CHAIN_WRITE_CLAIM_IDLE_MS", 60000))
+CHAIN_WRITE_RETRY_BACKOFF = float(os.environ.get("CHAIN_WRITE_RETRY_BACKOFF", 2))
+EHR_COMPACTION_INTERVAL = float(os.environ.get("EHR_COMPACTION_INTERVAL", 300))
+
+# KEYS: retry set, stream. ARGV: now, limit. Moves due retries back onto the
+# stream; atomic, so concurrent workers never requeue the same job twice.
+REQUEUE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(due) do
+    local args = {}
+    for name, value in pairs(cjson.decode(member)) do
+        table.insert(args, name)
+        table.insert(args, value)
+    end
+    redis.call('XADD', KEYS[2], '*', unpack(args))
+    redis.call('ZREM', KEYS[1], member)
+end
+return #due
+"""
+
+
+def process_batch(connection, messages):
+    """Uploads every blob referenced by the batch through a single batched transaction.
+
+    Snapshot jobs for the same patient are folded into one upload because the
+    worker always reads the latest committed snapshot from Mongo. Segment jobs
+    upload only their delta segments.
+    """
+    snapshot_jobs, segment_jobs, failed = {}, {}, set()
+    for _, fields in messages:
+        update_job(connection, fields["job_id"], status="processing")
+        if fields.get("segment_ids"):
+            for segment_id in fields["segment_ids"].split(","):
+                segment_jobs.setdefault(segment_id, []).append(fields)
+        else:
+            snapshot_jobs.setdefault(fields["patient_id"], []).append(fields)
+
+    patients = {
+        str(patient.id): patient
+        for patient in Patient.objects(
+            id__in=list({fields["patient_id"] for _, fields in messages})
+        ).only("wallet_id", "ehr_content_hash")
+    }
+    snapshots = fetch_snapshots(list(snapshot_jobs))
+    # Segments already folded away by compaction are covered by its snapshot upload.
+    segments = {
+        str(segment.id): segment
+        for segment in EHRSegment.objects(id__in=list(segment_jobs)).only("encrypted_data")
+    }
+
+    uploads = []
+    for patient_id, jobs in snapshot_jobs.items():
+        if patient_id in snapshots:
+            uploads.append((patients.get(patient_id), patients.get(patient_id), jobs))
+        else:
+            failed.update(fields["job_id"] for fields in jobs)
+    for segment_id, jobs in segment_jobs.items():
+        if segment_id in segments:
+            uploads.append((segments[segment_id], patients.get(jobs[0]["patient_id"]), jobs))
+    for target, patient, jobs in uploads:
+        if patient is None:
+            failed.update(fields["job_id"] for fields in jobs)
+    for job_id in failed:
+        update_job(connection, job_id, status="failed", error="Patient or EHR snapshot not found")
+    uploads = [upload for upload in uploads if upload[1] is not None]
+
+    try:
+        blob_ids = store_to_walrus_batch([
+            (target.encrypted_data if isinstance(target, EHRSegment) else snapshots[str(target.id)], patient.wallet_id)
+            for target, patient, _ in uploads
+        ]) if uploads else []
+    except Exception as e:
+        retry(connection, [fields for _, fields in messages if fields["job_id"] not in failed], str(e))
+    else:
+        job_blobs = {}
+        for (target, _, jobs), blob_id in zip(uploads, blob_ids):
+            target.update(walrus_blob_id=blob_id)
+            if isinstance(target, Patient):
+                blob_cache.put(blob_id, snapshots[str(target.id)], target.ehr_content_hash)
+            for fields in jobs:
+                job_blobs.setdefault(fields["job_id"], []).append(blob_id)
+        for _, fields in messages:
+            if fields["job_id"] not in failed:
+                update_job(connection, fields["job_id"], status="done",
+                           walrus_blob_id=",".join(job_blobs.get(fields["job_id"], [])))
+    connection.xack(CHAIN_WRITE_STREAM, CHAIN_WRITE_GROUP, *[message_id for message_id, _ in messages])
+
+
+def read_batch(connection, consumer):
+    """Blocks for the first message, then lingers up to CHAIN_WRITE_LINGER_MS to fill the batch."""
+    messages = []
+    deadline = None
+    while len(messages) < CHAIN_WRITE_BATCH_SIZE:
+        if deadline is None:
+            block = CHAIN_WRITE_BLOCK_MS
+        else:
+            block = int((deadline - time.monotonic()) * 1000)
+            if block <= 0:
+                break
+        response = connection.xreadgroup(
+            CHAIN_WRITE_GROUP, consumer, {CHAIN_WRITE_STREAM: ">"},
+            count=CHAIN_WRITE_BATCH_SIZE - len(messages), block=block
+        )
+        if not response:
+            break
+        for _, stream_messages in response:
+            messages.extend(stream_messages)
+        if deadline is None:
+            deadline = time.monotonic() + CHAIN_WRITE_LINGER_MS / 1000
+    return messages
+
+
+def retry(connection, jobs, error):
+    """Schedules failed jobs with exponential backoff until CHAIN_WRITE_MAX_ATTEMPTS.
+
+    Nothing sleeps here: each job is parked in CHAIN_WRITE_RETRIES until its
+    not-before time and requeue_due puts it back on the stream.
+    """
+    for fields in jobs:
+        job_id = fields["job_id"]
+        attempts = connection.hincrby(f"ehr_job:{job_id}", "attempts", 1)
+        if attempts >= CHAIN_WRITE_MAX_ATTEMPTS:
+            update_job(connection, job_id, status="failed", error=error)
+            continue
+        backoff = min(CHAIN_WRITE_RETRY_BACKOFF ** attempts, 60)
+        update_job(connection, job_id, status="retrying", error=error, retry_at=time.time() + backoff)
+        connection.zadd(CHAIN_WRITE_RETRIES, {json.dumps(fields, sort_keys=True): time.time() + backoff})
+
+
+def requeue_due(connection, script):
+    """Moves retries whose backoff has elapsed back onto the stream."""
+    return script(keys=[CHAIN_WRITE_RETRIES, CHAIN_WRITE_STREAM], args=[time.time(), CHAIN_WRITE_BATCH_SIZE])
+
+
+def run(consumer=None):
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    connection = get_redis()
+    ensure_group(connection)
+    requeue_script = connection.register_script(REQUEUE_DUE_SCRIPT)
+    print(f"Chain-write worker {consumer} listening on {CHAIN_WRITE_STREAM}")
+    last_compaction = time.monotonic()
+    while True:
+        if time.monotonic() - last_compaction > EHR_COMPACTION_INTERVAL:
+            for patient in compact_pending():
+                enqueue_chain_write(patient, requested_by="compaction", connection=connection)
+            last_compaction = time.monotonic()
+        requeue_due(connection, requeue_script)
+        claimed = connection.xautoclaim(
+            CHAIN_WRITE_STREAM, CHAIN_WRITE_GROUP, consumer,
+            min_idle_time=CHAIN_WRITE_CLAIM_IDLE_MS, count=CHAIN_WRITE_BATCH_SIZE
+        )[1]
+        if claimed:
+            process_batch(connection, claimed)
+        messages = read_batch(connection, consumer)
+        if messages:
+            process_batch(connection, messages)
+
+
+if __name__ == "__main__":
+    initialize_db()
+    run()
@@ -3,6 +3,7 @@ module ehr_module::ehr_module {
     use sui::object::{Self, UID};
     use sui::tx_context::{Self, TxContext};
     use sui::transfer;
+    use sui::event;
     // Placeholder for Walrus module (replace with actual import)
     use ehr_module::walrus_mock as walrus;
 
@@ -12,9 +13,17 @@ module ehr_module::ehr_module {
         blob_id: vector<u8>,
     }
 
+    // Emitted once per store_ehr call so batched transactions can map
+    // each blob_id back to its patient wallet
+    public struct EHRStored has copy, drop {
+        wallet_id: address,
+        blob_id: vector<u8>,
+    }
+
     // Store EHR data on Walrus and create an EHR object
     public entry fun store_ehr(encrypted_data: vector<u8>, wallet_id: address, ctx: &mut TxContext) {
         let blob_id = walrus::store(encrypted_data); // Mock or real Walrus call
+        event::emit(EHRStored { wallet_id, blob_id });
         let ehr = EHR {
             id: object::new(ctx),
             wallet_id,